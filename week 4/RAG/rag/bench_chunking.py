@@ -0,0 +1,75 @@
+"""Chunking throughput benchmark.
+
+    python rag/bench_chunking.py [book_dir] [--repeat N]
+
+Reports MB/s for the tokenizer path and the word fallback over the markdown
+corpus (or a synthetic one when the book is not checked out). The fallback
+only approximates the token limit (WORDS_PER_TOKEN words per token), so it
+produces different chunks and is not an equivalent path; with a tokenizer
+available the benchmark also counts its chunks that exceed the limit.
+"""
+import os
+import time
+import argparse
+import random
+
+from chunking import chunk_text, get_tokenizer, MODEL_MAX_TOKENS, SPECIAL_TOKENS, WORDS_PER_TOKEN
+from cli import iter_markdown_files, BOOK_DIR
+
+
+def load_corpus(book_dir):
+    docs = []
+    for f in iter_markdown_files(book_dir):
+        with open(f, "r", encoding="utf-8", errors="ignore") as fh:
+            docs.append(fh.read())
+    if docs:
+        return docs
+    rng = random.Random(0)
+    words = "type interface arrow function generic promise class module enum never".split()
+    for d in range(200):
+        sections = []
+        for s in range(8):
+            body = " ".join(rng.choice(words) for _ in range(rng.randint(50, 1500)))
+            sections.append(f"## Section {d}.{s}\n{body}")
+        docs.append("\n\n".join(sections))
+    return docs
+
+
+def bench(docs, tokenizer, repeat):
+    n_bytes = sum(len(d.encode("utf-8")) for d in docs) * repeat
+    chunks = []
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        chunks = [c for d in docs for c in chunk_text(d, tokenizer=tokenizer)]
+    elapsed = time.perf_counter() - t0
+    return n_bytes / elapsed / 1e6, chunks, elapsed
+
+
+def overlong(chunks, tokenizer):
+    """Chunks the model would truncate."""
+    limit = MODEL_MAX_TOKENS - SPECIAL_TOKENS
+    lengths = tokenizer(chunks, add_special_tokens=False, verbose=False)["input_ids"]
+    return sum(len(ids) > limit for ids in lengths)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("book_dir", nargs="?", default=BOOK_DIR)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    docs = load_corpus(args.book_dir)
+    size_mb = sum(len(d.encode("utf-8")) for d in docs) / 1e6
+    print(f"corpus: {len(docs)} docs, {size_mb:.2f} MB, token limit {MODEL_MAX_TOKENS}")
+    paths = [("words", None)]
+    tok = get_tokenizer()
+    if tok is not None:
+        paths.append(("tokenizer", tok))
+    for name, t in paths:
+        mbps, chunks, elapsed = bench(docs, t, args.repeat)
+        line = f"{name:>10}: {mbps:8.2f} MB/s  {len(chunks)} chunks  ({elapsed:.2f}s)"
+        if t is None:
+            line += f"  approximate, {WORDS_PER_TOKEN} words/token"
+            if tok is not None:
+                line += f", {overlong(chunks, tok)} over the token limit"
+        print(line)
@@ -0,0 +1,78 @@
+"""Recall and size impact of scalar quantization on a saved index.
+
+    python rag/bench_quantization.py [rag_index.faiss] [--queries N] [--k K]
+                                     [--batch-size 256] [--train-size N]
+
+Uses stored vectors (with a little noise) as queries, so no model is needed.
+Recall@k is measured against exact search on the float32 vectors. Quantized
+indexes are built the way --reindex builds them: the stored vectors are fed
+to EmbeddingStore.add_vectors in --batch-size batches, with the quantizer
+trained after --train-size vectors (EMBED_QUANT_TRAIN_SIZE).
+"""
+import time
+import argparse
+
+import faiss
+import numpy as np
+
+import embeddings
+from embeddings import EmbeddingStore, INDEX_PATH, QUANTIZERS, index_metric, new_index
+from cli import DEFAULT_BATCH_SIZE
+
+
+def recall_at_k(truth: np.ndarray, found: np.ndarray) -> float:
+    k = truth.shape[1]
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+    return hits / (len(truth) * k)
+
+
+def index_bytes(index) -> int:
+    return int(faiss.serialize_index(index).size)
+
+
+def streamed_index(vecs, quantization, metric, batch_size):
+    store = EmbeddingStore(quantization=quantization, metric=metric)
+    for start in range(0, len(vecs), batch_size):
+        store.add_vectors(vecs[start:start + batch_size])
+    store.finish_vectors()
+    return store.index
+
+
+def timed_search(index, queries, k):
+    t0 = time.perf_counter()
+    _, ids = index.search(queries, k)
+    return ids, (time.perf_counter() - t0) / len(queries) * 1e3
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("index_path", nargs="?", default=INDEX_PATH)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--train-size", type=int, default=embeddings.QUANT_TRAIN_SIZE)
+    args = parser.parse_args()
+    embeddings.QUANT_TRAIN_SIZE = args.train_size
+
+    base = faiss.read_index(args.index_path)
+    vecs = base.reconstruct_n(0, base.ntotal)
+    flat = new_index(base.d, metric=index_metric(base))
+    flat.add(vecs)
+
+    rng = np.random.default_rng(0)
+    picks = rng.choice(len(vecs), size=min(args.queries, len(vecs)), replace=False)
+    noise = rng.normal(scale=vecs.std() * 0.1, size=(len(picks), base.d))
+    queries = np.ascontiguousarray(vecs[picks] + noise, dtype=np.float32)
+    k = min(args.k, base.ntotal)
+
+    truth, ms = timed_search(flat, queries, k)
+    flat_size = index_bytes(flat)
+    print(f"{base.ntotal} vectors, d={base.d}, k={k}, {len(queries)} queries, "
+          f"batches of {args.batch_size}, quantizer trained on {min(args.train_size, base.ntotal)}")
+    print(f"{'float32':>8}: {flat_size / 1e6:8.2f} MB  recall@{k} 1.0000  {ms:.3f} ms/query")
+    for name in sorted(QUANTIZERS):
+        index = streamed_index(vecs, name, index_metric(base), args.batch_size)
+        found, ms = timed_search(index, queries, k)
+        size = index_bytes(index)
+        print(f"{name:>8}: {size / 1e6:8.2f} MB  recall@{k} {recall_at_k(truth, found):.4f}  "
+              f"{ms:.3f} ms/query  ({flat_size / size:.1f}x smaller)")
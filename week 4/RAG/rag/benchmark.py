@@ -0,0 +1,241 @@
+"""Retrieval benchmark for the RAG stack.
+
+    python rag/benchmark.py [--queries q.jsonl | --generate 200] [--k 10]
+                            [--shards N] [--dense-only] [--build]
+                            [--concurrency 1 4 8] [--url http://localhost:8000/search]
+                            [--out report.json] [--baseline old.json]
+
+The labeled query set is either loaded from JSON lines
+({"query": ..., "relevant": [chunk ids]}) or generated by taking a span of
+words from randomly chosen chunks, with that chunk as the only relevant id.
+The report measures:
+
+* quality: recall@k and MRR against the labels, and recall@k of the
+  configured index against exact (flat) search over the same stored vectors
+* per-stage latency: query embedding, vector search, BM25, metadata fetch
+* end-to-end answer_query throughput at several thread counts, and
+  optionally over HTTP against a running server
+* optionally index build time and peak RSS (--build)
+
+Reports are JSON with the configuration alongside the numbers; --baseline
+prints the change of every metric against an earlier report.
+"""
+import os
+import json
+import time
+import random
+import argparse
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from cli import BOOK_DIR, answer_query, build_or_load_index
+from embeddings import DEFAULT_CANDIDATES, INDEX_PATH, QUANTIZATION, as_float32_matrix, new_index
+
+
+def percentiles(samples_ms):
+    a = np.asarray(samples_ms, dtype=np.float64)
+    if a.size == 0:
+        return {}
+    return {"mean": float(a.mean()), "p50": float(np.percentile(a, 50)),
+            "p95": float(np.percentile(a, 95)), "p99": float(np.percentile(a, 99))}
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def store_parts(store):
+    """Yield (global id offset, EmbeddingStore) for single or sharded stores."""
+    if hasattr(store, "shards"):
+        from sharding import SHARD_BITS
+        for i, s in store._live():
+            yield i << SHARD_BITS, s
+    else:
+        yield 0, store
+
+
+def generate_queries(store, n, seed=0, span=12):
+    rng = random.Random(seed)
+    ids = [off + j for off, s in store_parts(store) for j in range(len(s.metadatas))]
+    queries = []
+    for gid in rng.sample(ids, min(n, len(ids))):
+        words = store.metadatas[gid]["text"].split()
+        if len(words) < 3:
+            continue
+        start = rng.randint(0, max(0, len(words) - span))
+        queries.append({"query": " ".join(words[start:start + span]), "relevant": [gid]})
+    return queries
+
+
+def load_queries(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def exact_index(store):
+    """Flat index with the store's metric over the stored (decoded) vectors, with global ids."""
+    vecs, ids = [], []
+    for off, s in store_parts(store):
+        vecs.append(s.index.reconstruct_n(0, s.index.ntotal))
+        ids.append(off + np.arange(s.index.ntotal, dtype=np.int64))
+    flat = new_index(vecs[0].shape[1], metric=encoder_of(store).metric)
+    flat.add(as_float32_matrix(np.concatenate(vecs)))
+    return flat, np.concatenate(ids)
+
+
+def encoder_of(store):
+    return getattr(store, "encoder", store)
+
+
+def measure_quality_and_stages(store, queries, k, hybrid, candidates):
+    flat, flat_ids = exact_index(store)
+    enc = encoder_of(store)
+    stages = {"embed": [], "search": [], "lexical": [], "fetch": []}
+    hits, rr, agree = 0, 0.0, 0.0
+    for q in queries:
+        t0 = time.perf_counter()
+        qvec = as_float32_matrix(enc.encode_query(q["query"]))
+        t1 = time.perf_counter()
+        D, I = store.search_vector(qvec, k)
+        t2 = time.perf_counter()
+        stages["embed"].append((t1 - t0) * 1e3)
+        stages["search"].append((t2 - t1) * 1e3)
+        if hybrid and getattr(store, "lexical", None) is not None:
+            t0 = time.perf_counter()
+            store.lexical.search(q["query"], candidates)
+            stages["lexical"].append((time.perf_counter() - t0) * 1e3)
+
+        ranked = [i for _, i in store.retrieve(q["query"], k, hybrid=hybrid, candidates=candidates)]
+        t0 = time.perf_counter()
+        for i in ranked:
+            store.metadatas[i]
+        stages["fetch"].append((time.perf_counter() - t0) * 1e3)
+
+        relevant = set(q["relevant"])
+        for rank, i in enumerate(ranked, start=1):
+            if i in relevant:
+                hits += 1
+                rr += 1.0 / rank
+                break
+        _, FI = flat.search(qvec, k)
+        truth = {int(flat_ids[j]) for j in FI[0] if j >= 0}
+        agree += len(truth & {int(i) for i in I}) / max(len(truth), 1)
+    n = max(len(queries), 1)
+    quality = {f"recall@{k}": hits / n, "mrr": rr / n, f"flat_recall@{k}": agree / n}
+    return quality, {name: percentiles(v) for name, v in stages.items() if v}
+
+
+def measure_throughput(fn, queries, concurrency):
+    latencies = []
+
+    def one(q):
+        t0 = time.perf_counter()
+        fn(q["query"])
+        latencies.append((time.perf_counter() - t0) * 1e3)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, queries))
+    elapsed = time.perf_counter() - t0
+    return {"concurrency": concurrency, "qps": len(queries) / elapsed, "latency_ms": percentiles(latencies)}
+
+
+def http_search(url):
+    def fn(query):
+        with urllib.request.urlopen(url + "?" + urllib.parse.urlencode({"q": query})) as resp:
+            resp.read()
+    return fn
+
+
+def index_size_mb(store):
+    paths = []
+    if hasattr(store, "shards"):
+        from sharding import shard_paths
+        paths = [shard_paths(store.shard_dir, i)["index_path"] for i, _ in store._live()]
+    else:
+        paths = [INDEX_PATH]
+    return sum(os.path.getsize(p) for p in paths if os.path.exists(p)) / 1e6
+
+
+def compare(report, baseline, prefix=""):
+    for key, value in report.items():
+        old = baseline.get(key) if isinstance(baseline, dict) else None
+        if isinstance(value, dict):
+            compare(value, old or {}, prefix + key + ".")
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            print(f"{prefix + key:<45} {old:12.4f} -> {value:12.4f}  ({(value - old) / old * 100:+.1f}%)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", help="JSON lines with query and relevant ids")
+    parser.add_argument("--generate", type=int, default=200, help="queries to generate when --queries is absent")
+    parser.add_argument("--save-queries", help="write the query set used to this path")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--candidates", type=int, default=DEFAULT_CANDIDATES)
+    parser.add_argument("--dense-only", action="store_true")
+    parser.add_argument("--shards", type=int, default=0)
+    parser.add_argument("--build", action="store_true", help="rebuild the index and time it")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--url", help="also load-test a running server, e.g. http://localhost:8000/search")
+    parser.add_argument("--out", default="rag_benchmark.json")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    args = parser.parse_args()
+    hybrid = not args.dense_only
+
+    report = {"config": {"k": args.k, "hybrid": hybrid, "candidates": args.candidates,
+                         "shards": args.shards, "quantization": QUANTIZATION,
+                         "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")}}
+
+    t0 = time.perf_counter()
+    if args.shards:
+        from sharding import build_or_load_sharded
+        store = build_or_load_sharded(BOOK_DIR, args.shards, force_reindex=args.build)
+    else:
+        store = build_or_load_index(BOOK_DIR, force_reindex=args.build)
+    load_s = time.perf_counter() - t0
+    report["index"] = {"chunks": len(store.metadatas), "size_mb": index_size_mb(store),
+                       "metric": encoder_of(store).metric,
+                       "build_s" if args.build else "load_s": load_s, "peak_rss_mb": peak_rss_mb()}
+
+    queries = load_queries(args.queries) if args.queries else generate_queries(store, args.generate)
+    if args.save_queries:
+        with open(args.save_queries, "w", encoding="utf-8") as f:
+            for q in queries:
+                f.write(json.dumps(q, ensure_ascii=False) + "\n")
+    report["config"]["queries"] = len(queries)
+
+    # one untimed query so model loading is not counted as search latency
+    answer_query(store, queries[0]["query"], hybrid=hybrid)
+    # every measurement starts with an empty query-embedding cache, so the
+    # model runs for each distinct query instead of only in the first pass
+    encoder_of(store).clear_query_cache()
+    report["quality"], report["stages_ms"] = measure_quality_and_stages(
+        store, queries, args.k, hybrid, args.candidates)
+
+    def in_process(query):
+        answer_query(store, query, k=args.k, hybrid=hybrid, candidates=args.candidates)
+
+    def cold_throughput(c):
+        encoder_of(store).clear_query_cache()
+        return measure_throughput(in_process, queries, c)
+
+    report["throughput"] = {f"threads_{c}": cold_throughput(c) for c in args.concurrency}
+    if args.url:
+        report["http"] = {f"threads_{c}": measure_throughput(http_search(args.url), queries, c)
+                          for c in args.concurrency}
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            compare(report, json.load(f))
@@ -0,0 +1,139 @@
+"""Token-aware markdown chunker.
+
+Each section is tokenized once with a fast (Rust) tokenizer that returns
+character offsets, then cut into windows of at most ``max_tokens`` tokens by
+slicing the original string, so no chunk is re-tokenized. Windows end on a
+word boundary where possible, can overlap, and carry their section heading.
+Without ``transformers`` (or offline) whitespace-separated words stand in for
+tokens, with the budget scaled by WORDS_PER_TOKEN: a word is often several
+word pieces (more so in markdown and code), so an unscaled word count would
+overrun the limit and the model would truncate the chunk. Runs without
+whitespace are cut every FALLBACK_WORD_CHARS characters and fallback chunks
+are capped at FALLBACK_MAX_CHARS, so a long URL or minified line is still
+split.
+"""
+import os
+import re
+import bisect
+import warnings
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from embeddings import MODEL_NAME
+
+HEADING_RE = re.compile(r"(?m)^#{1,6} .*$")
+
+# all-MiniLM-L6-v2 truncates input at 256 word pieces, [CLS] and [SEP] included
+MODEL_MAX_TOKENS = int(os.environ.get("EMBED_MAX_TOKENS", "256"))
+SPECIAL_TOKENS = 2
+DEFAULT_OVERLAP = 32
+# words allowed per token of budget when words stand in for tokens
+WORDS_PER_TOKEN = float(os.environ.get("CHUNK_WORDS_PER_TOKEN", "0.6"))
+# longer runs of non-space characters count as several words
+FALLBACK_WORD_CHARS = 16
+FALLBACK_MAX_CHARS = int(os.environ.get("CHUNK_FALLBACK_MAX_CHARS", "1000"))
+WORD_RE = re.compile(r"\S{1,%d}" % FALLBACK_WORD_CHARS)
+
+
+@lru_cache(maxsize=4)
+def get_tokenizer(model_name: str = MODEL_NAME):
+    """Return the model's fast tokenizer, or None to use the word fallback."""
+    repo = model_name if "/" in model_name else "sentence-transformers/" + model_name
+    try:
+        from transformers import AutoTokenizer
+        tok = AutoTokenizer.from_pretrained(repo)
+    except Exception as e:
+        tok = None
+        reason = repr(e)
+    else:
+        reason = "no fast tokenizer"
+    # offset mappings are only available from fast tokenizers
+    if tok is None or not getattr(tok, "is_fast", False):
+        warnings.warn(f"chunking by word count ({WORDS_PER_TOKEN} words per token) instead of "
+                      f"{repo} tokens: {reason}")
+        return None
+    return tok
+
+
+def token_spans(text: str, tokenizer=None) -> List[Tuple[int, int]]:
+    return token_spans_batch([text], tokenizer)[0]
+
+
+def token_spans_batch(texts: List[str], tokenizer=None) -> List[List[Tuple[int, int]]]:
+    if tokenizer is None:
+        return [[m.span() for m in WORD_RE.finditer(t)] for t in texts]
+    # one batched call lets the Rust tokenizer spread the sections over its thread pool
+    enc = tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+    return enc["offset_mapping"]
+
+
+def iter_sections(text: str):
+    """Yield (heading, body) pairs; heading is '' for text before the first heading."""
+    heading = ""
+    pos = 0
+    for m in HEADING_RE.finditer(text):
+        yield heading, text[pos:m.start()]
+        heading = m.group(0).strip()
+        pos = m.end()
+    yield heading, text[pos:]
+
+
+def _window_end(spans, start: int, limit: int) -> int:
+    end = min(start + limit, len(spans))
+    if end == len(spans):
+        return end
+    # back off to a whitespace gap so a word is not cut in half
+    for j in range(end, start + limit // 2, -1):
+        if spans[j - 1][1] < spans[j][0]:
+            return j
+    return end
+
+
+def chunk_text(text: str, max_tokens: Optional[int] = None, overlap: int = DEFAULT_OVERLAP,
+               tokenizer="auto") -> List[str]:
+    """Split markdown into heading-prefixed chunks that fit the model's token limit.
+
+    ``tokenizer="auto"`` uses the cached tokenizer for MODEL_NAME; pass None to
+    force the word-based fast path.
+    """
+    if tokenizer == "auto":
+        tokenizer = get_tokenizer()
+    limit = MODEL_MAX_TOKENS - SPECIAL_TOKENS
+    if max_tokens:
+        limit = min(limit, max_tokens)
+    if tokenizer is None:
+        limit = max(1, int(limit * WORDS_PER_TOKEN))
+        overlap = int(overlap * WORDS_PER_TOKEN)
+
+    sections = list(iter_sections(text))
+    if not sections:
+        return []
+    headings = [h for h, _ in sections]
+    all_spans = token_spans_batch([b for _, b in sections] + headings, tokenizer)
+    chunks = []
+    for (heading, body), spans, heading_spans in zip(sections, all_spans, all_spans[len(sections):]):
+        if not spans:
+            continue
+        # the heading is repeated on every chunk, so it comes out of the budget
+        budget = limit
+        if heading:
+            budget = max(limit // 2, limit - len(heading_spans) - 1)
+        step_back = min(overlap, budget // 2)
+        ends = [e for _, e in spans] if tokenizer is None else None
+        start = 0
+        while start < len(spans):
+            end = _window_end(spans, start, budget)
+            if tokenizer is None:
+                # words are only an estimate; also bound the chunk's length
+                end = max(start + 1, bisect.bisect_right(ends, spans[start][0] + FALLBACK_MAX_CHARS,
+                                                         start, end))
+            piece = body[spans[start][0]:spans[end - 1][1]]
+            chunks.append(f"{heading}\n{piece}" if heading else piece)
+            if end == len(spans):
+                break
+            nxt = end - step_back
+            # likewise start the overlap at the beginning of a word
+            while nxt < end and nxt > 0 and spans[nxt - 1][1] >= spans[nxt][0]:
+                nxt += 1
+            start = max(nxt, start + 1)
+    return chunks
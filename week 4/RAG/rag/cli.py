@@ -1,67 +1,162 @@
 import os
 import argparse
 from glob import glob
-from embeddings import EmbeddingStore
-import re
+from embeddings import EmbeddingStore, META_PATH, DEFAULT_CANDIDATES, QUANTIZATION, QUANTIZERS, METRIC, METRICS
+from metastore import MetadataWriter, MetadataReader
+from chunking import chunk_text, DEFAULT_OVERLAP
+from lexical import BM25Builder, BM25Index
+from rerank import DEFAULT_RERANK_CANDIDATES
 
 BOOK_DIR = "typescript-book"
+# chunks embedded and added to the index per step; bounds peak memory
+DEFAULT_BATCH_SIZE = 256
 
 def load_markdown_files(base_dir):
-    patterns = [os.path.join(base_dir, "**", "*.md")]
-    files = []
-    for p in patterns:
-        files.extend(glob(p, recursive=True))
-    return files
-
-def split_text(text, max_tokens=400):
-    # naive splitter: split by headings and paragraphs, fallback to fixed window
-    parts = re.split(r"(?m)^#{1,6} .*$", text)
-    chunks = []
-    for p in parts:
-        p = p.strip()
-        if not p:
-            continue
-        if len(p) <= 2000:
-            chunks.append(p)
-        else:
-            # split into approximate 1000-char slices
-            for i in range(0, len(p), 1000):
-                chunks.append(p[i:i+1000])
-    return chunks
-
-
-def build_or_load_index(book_dir, force_reindex=False):
-    store = EmbeddingStore()
-    if not force_reindex and store.load():
-        print("Loaded existing index")
-        return store
-    files = load_markdown_files(book_dir)
-    texts = []
-    sources = []
+    return list(iter_markdown_files(base_dir))
+
+
+def iter_markdown_files(base_dir):
+    yield from glob(os.path.join(base_dir, "**", "*.md"), recursive=True)
+
+
+def iter_documents(files):
     for f in files:
         try:
             with open(f, "r", encoding="utf-8") as fh:
-                content = fh.read()
+                yield f, fh.read()
         except Exception as e:
             print("skip", f, e)
-            continue
-        chunks = split_text(content)
-        for i, c in enumerate(chunks):
-            texts.append(c)
-            sources.append({"file": os.path.relpath(f, book_dir), "chunk": i})
-    store.build_index(texts)
-    store.metadatas = [{"text": t, "source": s} for t, s in zip(texts, sources)]
-    store.save()
-    print(f"Indexed {len(texts)} chunks from {len(files)} files")
+
+
+def iter_chunks(documents, book_dir):
+    for f, content in documents:
+        for i, c in enumerate(split_text(content)):
+            yield c, {"file": os.path.relpath(f, book_dir), "chunk": i}
+
+
+def batched(iterable, n):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def split_text(text, max_tokens=None, overlap=DEFAULT_OVERLAP):
+    # heading-aware, token-limited windows; see chunking.py
+    return chunk_text(text, max_tokens=max_tokens, overlap=overlap)
+
+
+def load_index(mmap=False):
+    """Load the prebuilt index without building or migrating anything.
+
+    For server workers: several processes building or rewriting the same
+    files at once would clobber each other, so a missing index, or one saved
+    before streaming metadata or hybrid search, is an error here.
+    """
+    store = EmbeddingStore()
+    if not store.load(mmap=mmap):
+        raise RuntimeError("No index found; build it first with: python -m rag.cli --reindex")
+    if not isinstance(store.metadatas, MetadataReader) or store.lexical is None:
+        raise RuntimeError("The index was saved by an older version; migrate it first with: python -m rag.cli")
+    return store
+
+
+def build_or_load_index(book_dir, force_reindex=False, workers=0, checkpoint_dir=None,
+                        batch_size=DEFAULT_BATCH_SIZE, quantization=QUANTIZATION, mmap=False,
+                        metric=METRIC):
+    store = EmbeddingStore(quantization=quantization, metric=metric)
+    if not force_reindex and store.load(mmap=mmap):
+        print("Loaded existing index")
+        migrated = False
+        if store.convert(quantization, metric):
+            # re-encode stored vectors (e.g. normalize an L2 index saved before
+            # cosine mode); no need to re-embed the corpus
+            migrated = True
+            print(f"Converted index to {store.quantization or 'float32'}, {store.metric}")
+        if store.lexical is None:
+            # one-off migration for indexes saved before hybrid search
+            store.lexical = BM25Index.build(m["text"] for m in store.metadatas)
+            migrated = True
+            print("Built lexical index")
+        # pickled metadata from before streaming ingestion is rewritten as JSONL
+        if migrated or not isinstance(store.metadatas, MetadataReader):
+            store.save()
+        return store
+    # files -> documents -> chunks -> batches; only one batch is held in memory at a time
+    files = iter_markdown_files(book_dir)
+    n_chunks, n_files = index_chunks(store, iter_chunks(iter_documents(files), book_dir),
+                                     batch_size=batch_size, workers=workers,
+                                     checkpoint_dir=checkpoint_dir)
+    print(f"Indexed {n_chunks} chunks from {n_files} files")
     return store
 
 
-def answer_query(store, q):
-    res = store.query(q, k=3)
+def index_chunks(store, chunks, batch_size=DEFAULT_BATCH_SIZE, workers=0, checkpoint_dir=None,
+                 meta_path=META_PATH, **save_paths):
+    """Embed a stream of (text, source) chunks into ``store`` and save it.
+
+    Returns (number of chunks, number of source files).
+    """
+    batches = batched(chunks, batch_size)
+    if workers and workers > 1:
+        from parallel import embed_shards_parallel
+        embedded = embed_shards_parallel(batches, workers=workers, checkpoint_dir=checkpoint_dir,
+                                         text_of=lambda c: c[0])
+    elif checkpoint_dir:
+        from parallel import embed_shards
+        embedded = embed_shards(batches, store.encode, checkpoint_dir=checkpoint_dir, text_of=lambda c: c[0])
+    else:
+        embedded = ((b, store.encode([t for t, _ in b])) for b in batches)
+    store.index = None
+    sources = set()
+    lexical = BM25Builder()
+    with MetadataWriter(meta_path) as writer:
+        for batch, vecs in embedded:
+            store.add_vectors(vecs)
+            for t, s in batch:
+                writer.append({"text": t, "source": s})
+                lexical.add(t)
+                sources.add(s["file"])
+        n_chunks = len(writer)
+        if n_chunks == 0:
+            raise ValueError("No texts provided to build index")
+    store.finish_vectors()
+    store.metadatas = MetadataReader(meta_path)
+    store.lexical = lexical.build()
+    store.save(meta_path=meta_path, **save_paths)
+    if checkpoint_dir:
+        # the index is saved; stale vectors must not outlive it
+        from parallel import clear_checkpoints
+        clear_checkpoints(checkpoint_dir)
+    return n_chunks, len(sources)
+
+
+def answer_query(store, q, k=3, hybrid=True, candidates=DEFAULT_CANDIDATES, reranker=None,
+                 rerank_candidates=DEFAULT_RERANK_CANDIDATES, budget_ms=None, sources=None):
+    if reranker is None:
+        hits = store.retrieve(q, k=k, hybrid=hybrid, candidates=candidates, sources=sources)
+        rerank_scores = {}
+    else:
+        # cheap first stage: a wider pool for the cross-encoder to reorder within budget_ms
+        pool = store.retrieve(q, k=rerank_candidates, hybrid=hybrid,
+                              candidates=max(candidates, rerank_candidates), sources=sources)
+        first_stage = {i: score for score, i in pool}
+        ranked = reranker.rerank(q, [(i, store.metadatas[i]["text"]) for _, i in pool], k,
+                                 budget_ms=budget_ms)
+        hits = [(first_stage[i], i) for i, _ in ranked]
+        rerank_scores = {i: s for i, s in ranked if s is not None}
     # return the best snippet with sources
     snippets = []
-    for dist, meta in res:
-        snippets.append({"score": dist, "text": meta["text"], "source": meta.get("source")})
+    for score, i in hits:
+        meta = store.metadatas[i]
+        snippet = {"score": score, "text": meta["text"], "source": meta.get("source")}
+        if i in rerank_scores:
+            snippet["rerank_score"] = rerank_scores[i]
+        snippets.append(snippet)
     # naive answer selection: return the first snippet that contains '=>' or '!!' if those are asked for
     return snippets
 
@@ -69,11 +164,48 @@ def answer_query(store, q):
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("--reindex", action="store_true")
+    parser.add_argument("--workers", type=int, default=0, help="encode with N worker processes")
+    parser.add_argument("--checkpoint-dir", default=None, help="resume an interrupted build (cleared when it finishes)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="chunks embedded per step while indexing")
+    parser.add_argument("--quantize", choices=sorted(QUANTIZERS), default=QUANTIZATION,
+                        help="store vectors as fp16 or 8-bit scalars")
+    parser.add_argument("--metric", choices=METRICS, default=METRIC,
+                        help="l2 distance or cosine similarity; converts an existing index")
+    parser.add_argument("--dense-only", action="store_true", help="skip BM25 fusion")
+    parser.add_argument("--candidates", type=int, default=DEFAULT_CANDIDATES,
+                        help="candidates per retriever before fusion")
+    parser.add_argument("--shards", type=int, default=0, help="use a sharded index with N shards")
+    parser.add_argument("--shard-id", type=int, default=None, help="with --reindex, build only this shard")
+    parser.add_argument("--source", action="append", default=None,
+                        help="only search files matching this pattern or directory (repeatable)")
+    parser.add_argument("--rerank", action="store_true", help="rerank with a cross-encoder")
+    parser.add_argument("--rerank-candidates", type=int, default=DEFAULT_RERANK_CANDIDATES)
+    parser.add_argument("--budget-ms", type=float, default=None, help="latency budget for reranking")
     parser.add_argument("query", nargs="?")
     args = parser.parse_args()
-    store = build_or_load_index(BOOK_DIR, force_reindex=args.reindex)
+    build_args = dict(workers=args.workers, checkpoint_dir=args.checkpoint_dir, batch_size=args.batch_size)
+    if args.shards and args.shard_id is not None:
+        from sharding import build_shard
+        n_chunks, n_files = build_shard(BOOK_DIR, args.shard_id, args.shards,
+                                        quantization=args.quantize, metric=args.metric, **build_args)
+        print(f"shard {args.shard_id}: indexed {n_chunks} chunks from {n_files} files")
+        raise SystemExit(0)
+    if args.shards:
+        from sharding import build_or_load_sharded
+        store = build_or_load_sharded(BOOK_DIR, args.shards, force_reindex=args.reindex,
+                                      quantization=args.quantize, metric=args.metric, **build_args)
+    else:
+        store = build_or_load_index(BOOK_DIR, force_reindex=args.reindex,
+                                    quantization=args.quantize, metric=args.metric, **build_args)
     if args.query:
-        res = answer_query(store, args.query)
+        reranker = None
+        if args.rerank:
+            from rerank import Reranker
+            reranker = Reranker()
+        res = answer_query(store, args.query, hybrid=not args.dense_only, candidates=args.candidates,
+                           reranker=reranker, rerank_candidates=args.rerank_candidates,
+                           budget_ms=args.budget_ms, sources=args.source)
         import json
         print(json.dumps(res, indent=2, ensure_ascii=False))
     else:
@@ -1,73 +1,328 @@
 from typing import List, Tuple
 import os
-from sentence_transformers import SentenceTransformer
-import faiss
+from fnmatch import fnmatch
+from functools import lru_cache
 import numpy as np
-import pickle
+from metastore import MetadataReader, write_metadata, load_metadata, source_ranges, replace_file
+from lexical import BM25Index, BM25_PATH, reciprocal_rank_fusion
 
 MODEL_NAME = os.environ.get("EMBED_MODEL", "all-MiniLM-L6-v2")
 INDEX_PATH = "rag_index.faiss"
-META_PATH = "rag_meta.pkl"
+META_PATH = "rag_meta.jsonl"
+# candidates taken from each retriever before rank fusion
+DEFAULT_CANDIDATES = 20
+# optional scalar quantization of stored vectors: "fp16" (2x smaller) or "sq8" (4x)
+QUANTIZATION = os.environ.get("EMBED_QUANT") or None
+QUANTIZERS = {"fp16": "QT_fp16", "sq8": "QT_8bit"}
+# vectors buffered during a streaming build before a quantizer is trained
+# (sq8 learns per-dimension ranges); smaller corpora train on every vector
+QUANT_TRAIN_SIZE = int(os.environ.get("EMBED_QUANT_TRAIN_SIZE", "65536"))
+# "cosine" stores unit vectors in an inner-product index, so a search is one
+# dot product per vector and scores are cosine similarities; "l2" (the
+# default for new builds) keeps L2 distances
+METRIC = os.environ.get("EMBED_METRIC") or None
+METRICS = ("l2", "cosine")
+# "onnx" encodes queries with onnxruntime from EMBED_ONNX_DIR instead of torch
+QUERY_BACKEND = os.environ.get("EMBED_BACKEND", "torch")
+ONNX_DIR = os.environ.get("EMBED_ONNX_DIR", "onnx-model")
+# recent query texts whose embeddings are kept, so repeats skip the model
+QUERY_CACHE_SIZE = 256
+
+# faiss and sentence-transformers (torch) are imported on first use so that
+# loading a prebuilt index, or importing cli/server, stays fast
+
+
+def as_float32_matrix(vecs) -> np.ndarray:
+    # FAISS needs C-contiguous float32; this only copies when the input isn't already
+    vecs = np.ascontiguousarray(vecs, dtype=np.float32)
+    if vecs.ndim == 1:
+        # single vector returned as 1D -> make it (1, d)
+        vecs = vecs.reshape(1, -1)
+    return vecs
+
+
+def normalize_rows(vecs) -> np.ndarray:
+    vecs = as_float32_matrix(vecs)
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    return vecs / np.clip(norms, 1e-12, None)
+
+
+def new_index(d: int, quantization=None, metric="l2"):
+    import faiss
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric {metric!r}, expected one of {list(METRICS)}")
+    if quantization is None:
+        return faiss.IndexFlatIP(d) if metric == "cosine" else faiss.IndexFlatL2(d)
+    if quantization not in QUANTIZERS:
+        raise ValueError(f"Unknown quantization {quantization!r}, expected one of {sorted(QUANTIZERS)}")
+    qtype = getattr(faiss.ScalarQuantizer, QUANTIZERS[quantization])
+    faiss_metric = faiss.METRIC_INNER_PRODUCT if metric == "cosine" else faiss.METRIC_L2
+    return faiss.IndexScalarQuantizer(d, qtype, faiss_metric)
+
+
+def index_metric(index) -> str:
+    import faiss
+    return "cosine" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+
+
+def index_quantization(index):
+    import faiss
+    if not isinstance(index, faiss.IndexScalarQuantizer):
+        return None
+    names = {getattr(faiss.ScalarQuantizer, qt): name for name, qt in QUANTIZERS.items()}
+    return names.get(index.sq.qtype)
+
+
+def convert_index(index, quantization=None, metric="l2"):
+    """Re-encode an index's stored vectors with another quantization and/or
+    metric. Converting to cosine normalizes the vectors on the way."""
+    vecs = index.reconstruct_n(0, index.ntotal)
+    if metric == "cosine":
+        vecs = normalize_rows(vecs)
+    out = new_index(index.d, quantization, metric)
+    if not out.is_trained:
+        out.train(vecs)
+    out.add(vecs)
+    return out
+
 
 class EmbeddingStore:
-    def __init__(self, model_name: str = MODEL_NAME):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, model_name: str = MODEL_NAME, quantization=QUANTIZATION,
+                 query_backend=QUERY_BACKEND, metric=METRIC):
+        self.model_name = model_name
+        self._model = None
+        self.query_backend = query_backend
+        self._query_encoder = None
+        self.quantization = quantization
+        self.metric = metric or "l2"
         self.index = None
         self.metadatas = []
+        self.lexical = None
+        self._source_ranges = None
+        self._selectors = {}
+        self.version = None
+        # batches held back until the quantizer has enough vectors to train on
+        self._untrained = []
+        self._encode_query_cached = lru_cache(maxsize=QUERY_CACHE_SIZE)(self._encode_query)
 
     def build_index(self, texts: List[str]):
         # Guard: no texts => nothing to index
         if not texts:
             raise ValueError("No texts provided to build index")
 
-        vecs = self.model.encode(texts, show_progress_bar=True, convert_to_numpy=True)
-        # Ensure we have a numpy array and a 2D shape (n, d)
-        vecs = np.asarray(vecs)
+        vecs = self.encode(texts, show_progress_bar=True)
+        self.index = None
+        self.add_vectors(vecs)
+        self.finish_vectors()
+        self.metadatas = [{"text": t, "id": i} for i, t in enumerate(texts)]
+        self.lexical = BM25Index.build(texts)
+        return
+
+    @property
+    def model(self):
+        # Constructed on first encode, not when the store is created
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+
+    def encode(self, texts: List[str], **kwargs):
+        return self.model.encode(texts, convert_to_numpy=True, **kwargs)
+
+    def encode_query(self, query: str):
+        return self._encode_query_cached(query)
+
+    def clear_query_cache(self):
+        self._encode_query_cached.cache_clear()
+
+    def _encode_query(self, query: str):
+        if self.query_backend == "onnx":
+            if self._query_encoder is None:
+                from onnx_encoder import OnnxEncoder
+                self._query_encoder = OnnxEncoder(ONNX_DIR)
+            return self._query_encoder.encode([query])
+        return self.encode([query])
+
+    def add_vectors(self, vecs):
+        """Append a batch of embeddings, creating the index on first use."""
+        vecs = as_float32_matrix(vecs)
         if vecs.size == 0:
             raise ValueError("Embeddings call returned empty vectors")
-        if vecs.ndim == 1:
-            # single vector returned as 1D -> make it (1, d)
-            vecs = vecs.reshape(1, -1)
 
-        # FAISS requires float32
-        if vecs.dtype != np.float32:
-            vecs = vecs.astype('float32')
+        if self.metric == "cosine":
+            # stored normalized, so queries never have to rescale the corpus
+            vecs = normalize_rows(vecs)
+        if self.index is None:
+            d = int(vecs.shape[1])
+            self.index = new_index(d, self.quantization, self.metric)
+            self._untrained = []
+        if not self.index.is_trained:
+            # training on the first small batch would clip every later one
+            # to its ranges, so wait for QUANT_TRAIN_SIZE vectors (or the end)
+            self._untrained.append(vecs)
+            if sum(len(v) for v in self._untrained) >= QUANT_TRAIN_SIZE:
+                self.finish_vectors()
+            return
+        self.index.add(vecs)
 
-        d = int(vecs.shape[1])
-        self.index = faiss.IndexFlatL2(d)
+    def finish_vectors(self):
+        """Train the quantizer on any held-back vectors and add them; call
+        once after the last add_vectors of a build (save does it too)."""
+        if not self._untrained:
+            return
+        vecs = np.concatenate(self._untrained)
+        self._untrained = []
+        self.index.train(vecs)
         self.index.add(vecs)
-        self.metadatas = [{"text": t, "id": i} for i, t in enumerate(texts)]
-        return
 
-    def save(self, index_path=INDEX_PATH, meta_path=META_PATH):
+    def convert(self, quantization=None, metric=None):
+        """Quantize a flat index and/or change its metric in place, from the
+        stored vectors and without re-embedding; returns False when there is
+        nothing to do. Both changes happen in one re-encoding, so the codes
+        are never decoded and quantized twice. A quantized index is not
+        converted to another quantization."""
+        import faiss
+        current = index_quantization(self.index), index_metric(self.index)
+        target = (quantization if quantization is not None and isinstance(self.index, faiss.IndexFlat)
+                  else current[0], metric or current[1])
+        if target == current:
+            return False
+        self.index = convert_index(self.index, *target)
+        self.quantization, self.metric = target
+        return True
+
+    def save(self, index_path=INDEX_PATH, meta_path=META_PATH, bm25_path=BM25_PATH):
         if self.index is None:
             raise RuntimeError("Index not built")
-        faiss.write_index(self.index, index_path)
-        with open(meta_path, "wb") as f:
-            pickle.dump(self.metadatas, f)
+        self.finish_vectors()
+        import faiss
+        # a new file renamed into place: server workers may have the old one mapped
+        replace_file(index_path, lambda tmp: faiss.write_index(self.index, tmp))
+        if self.lexical is not None and self.lexical.prefix != bm25_path:
+            self.lexical.save(bm25_path)
+        # Metadata streamed to disk during the build is already in place
+        if isinstance(self.metadatas, MetadataReader) and self.metadatas.path == meta_path:
+            return
+        write_metadata(self.metadatas, meta_path)
 
-    def load(self, index_path=INDEX_PATH, meta_path=META_PATH):
-        if not os.path.exists(index_path) or not os.path.exists(meta_path):
+    def load(self, index_path=INDEX_PATH, meta_path=META_PATH, bm25_path=BM25_PATH, mmap=False):
+        """Load a saved index. With ``mmap`` the vectors are mapped read-only
+        from disk instead of copied into the process, so worker processes
+        serving the same files share one copy in the page cache."""
+        if not os.path.exists(index_path):
+            return False
+        # Indexes built before streaming ingestion pickled the metadata list
+        legacy_path = os.path.splitext(meta_path)[0] + ".pkl"
+        metadatas = load_metadata(meta_path, legacy_path=legacy_path)
+        if metadatas is None:
             return False
-        self.index = faiss.read_index(index_path)
-        with open(meta_path, "rb") as f:
-            self.metadatas = pickle.load(f)
+        import faiss
+        if mmap:
+            # IO_FLAG_MMAP_IFC maps flat/SQ codes in place; older faiss only maps IVF lists
+            flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+            self.index = faiss.read_index(index_path, flags)
+        else:
+            self.index = faiss.read_index(index_path)
+        # the file, not the configuration, decides how scores are computed
+        self.metric = index_metric(self.index)
+        self.metadatas = metadatas
+        st = os.stat(index_path)
+        # identifies this build of the index, e.g. for cache invalidation
+        self.version = f"{self.index.ntotal}-{st.st_size}-{int(st.st_mtime)}"
+        # optional: indexes saved before hybrid search have no BM25 side files
+        self.lexical = BM25Index.load(bm25_path)
         return True
 
-    def query(self, query: str, k=3) -> List[Tuple[float, dict]]:
+    def search(self, query: str, k=3, sources=None):
+        """Dense search returning (scores, ids), with FAISS's -1 padding dropped.
+
+        Scores are L2 distances (lower is better), or cosine similarities
+        (higher is better) when the index metric is cosine.
+        """
         if self.index is None:
             raise RuntimeError("Index not built or loaded")
+        return self.search_vector(self.encode_query(query), k, sources=sources)
+
+    def search_vector(self, qvec, k=3, sources=None):
+        """Like search, for an already-encoded query."""
+        if self.index is None:
+            raise RuntimeError("Index not built or loaded")
+        params = None
+        if sources is not None:
+            mask, selector = self._selector(sources)
+            if not mask.any():
+                return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+            import faiss
+            # the filter is applied inside the scan, so no over-fetching is needed
+            params = faiss.SearchParameters(sel=selector)
+        qvec = normalize_rows(qvec) if self.metric == "cosine" else as_float32_matrix(qvec)
+        D, I = self.index.search(qvec, k, params=params)
+        keep = I[0] >= 0
+        return D[0][keep], I[0][keep]
+
+    def source_mask(self, sources) -> np.ndarray:
+        """Boolean mask over chunk ids whose source file matches ``sources``.
+
+        ``sources`` is one pattern or a list; each is an fnmatch pattern
+        ("docs/types/*.md") or a directory prefix ("docs/types"), with
+        '/' separators.
+        """
+        return self._selector(sources)[0]
+
+    def _selector(self, sources):
+        if isinstance(sources, str):
+            sources = [sources]
+        key = tuple(sources)
+        cached = self._selectors.get(key)
+        if cached is not None:
+            return cached[:2]
+        if self._source_ranges is None:
+            self._source_ranges = source_ranges(self.metadatas)
+        prefixes = [p.rstrip("/") + "/" for p in sources]
+        mask = np.zeros(self.index.ntotal, dtype=bool)
+        for f, runs in self._source_ranges.items():
+            f = f.replace("\\", "/")
+            if any(fnmatch(f, p) for p in sources) or f.startswith(tuple(prefixes)):
+                for start, end in runs:
+                    mask[start:end] = True
+        import faiss
+        bits = np.packbits(mask, bitorder="little")
+        if len(self._selectors) >= 256:
+            self._selectors.clear()
+        # keep the bitmap referenced alongside the selector that points into it
+        self._selectors[key] = (mask, faiss.IDSelectorBitmap(bits), bits)
+        return self._selectors[key][:2]
+
+    def retrieve(self, query: str, k=3, hybrid=False, candidates=DEFAULT_CANDIDATES,
+                 sources=None) -> List[Tuple[float, int]]:
+        """Return up to k (score, chunk id) pairs, best first.
+
+        Dense scores are as in search: L2 distances (lower is better) or,
+        for a cosine index, similarities (higher is better). With ``hybrid`` the
+        dense and BM25 rankings are fused with reciprocal rank fusion and the
+        score is the fused score (higher is better); without a lexical index
+        this falls back to dense search. ``sources`` restricts both
+        retrievers to matching files (see source_mask).
+        """
+        if not hybrid or self.lexical is None:
+            D, I = self.search(query, k, sources=sources)
+            return [(float(d), int(i)) for d, i in zip(D, I)]
+        candidates = max(candidates, k)
+        _, dense_ids = self.search(query, candidates, sources=sources)
+        mask = self.source_mask(sources) if sources is not None else None
+        lexical_ids = [i for _, i in self.lexical.search(query, candidates, mask=mask)]
+        fused = reciprocal_rank_fusion([[int(i) for i in dense_ids], lexical_ids])
+        return fused[:k]
+
+    def query(self, query: str, k=3, sources=None) -> List[Tuple[float, dict]]:
+        return [(score, self.metadatas[i]) for score, i in self.retrieve(query, k, sources=sources)]
 
-        qvec = self.model.encode([query], convert_to_numpy=True)
-        qvec = np.asarray(qvec)
-        if qvec.ndim == 1:
-            qvec = qvec.reshape(1, -1)
-        if qvec.dtype != np.float32:
-            qvec = qvec.astype('float32')
-
-        D, I = self.index.search(qvec, k)
-        results = []
-        for dist, idx in zip(D[0], I[0]):
-            meta = self.metadatas[int(idx)]
-            results.append((float(dist), meta))
-        return results
+    def hybrid_query(self, query: str, k=3, candidates=DEFAULT_CANDIDATES,
+                     sources=None) -> List[Tuple[float, dict]]:
+        """Fuse dense and BM25 rankings with reciprocal rank fusion (see retrieve)."""
+        hits = self.retrieve(query, k, hybrid=True, candidates=candidates, sources=sources)
+        return [(score, self.metadatas[i]) for score, i in hits]
@@ -0,0 +1,147 @@
+"""BM25 inverted index built next to the FAISS index.
+
+Postings are stored CSR-style in flat numpy arrays (term offsets, doc ids,
+term frequencies) plus a per-term idf table, one ``.npy`` file each, so a
+saved index is opened with ``mmap_mode='r'`` and only the postings a query
+touches are paged in. The vocabulary is a small JSON term -> id map.
+"""
+import os
+import re
+import json
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from metastore import save_array
+
+BM25_PATH = "rag_bm25"
+# words, plus runs of symbols so queries like "=>" or "!!" can match literally
+TOKEN_RE = re.compile(r"\w+|[^\w\s]+")
+ARRAYS = ("offsets", "docs", "tfs", "idf", "doclen")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+def _paths(prefix: str) -> Dict[str, str]:
+    paths = {name: f"{prefix}.{name}.npy" for name in ARRAYS}
+    paths["vocab"] = prefix + ".vocab.json"
+    return paths
+
+
+class BM25Builder:
+    """Accumulates postings one document at a time, in FAISS id order."""
+
+    def __init__(self):
+        self.vocab: Dict[str, int] = {}
+        self._docs: List[array] = []
+        self._tfs: List[array] = []
+        self._doclen = array("i")
+
+    def add(self, text: str):
+        doc_id = len(self._doclen)
+        tokens = tokenize(text)
+        self._doclen.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            tid = self.vocab.setdefault(term, len(self.vocab))
+            if tid == len(self._docs):
+                self._docs.append(array("i"))
+                self._tfs.append(array("f"))
+            self._docs[tid].append(doc_id)
+            self._tfs[tid].append(tf)
+
+    def __len__(self):
+        return len(self._doclen)
+
+    def build(self) -> "BM25Index":
+        counts = np.fromiter((len(d) for d in self._docs), dtype=np.int64, count=len(self._docs))
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        docs = np.frombuffer(b"".join(d.tobytes() for d in self._docs), dtype=np.int32)
+        tfs = np.frombuffer(b"".join(t.tobytes() for t in self._tfs), dtype=np.float32)
+        n = max(len(self._doclen), 1)
+        idf = np.log1p((n - counts + 0.5) / (counts + 0.5)).astype(np.float32)
+        doclen = np.frombuffer(self._doclen, dtype=np.int32).copy()
+        return BM25Index(self.vocab, offsets, docs, tfs, idf, doclen)
+
+
+class BM25Index:
+    def __init__(self, vocab: Dict[str, int], offsets, docs, tfs, idf, doclen,
+                 k1: float = 1.5, b: float = 0.75, prefix: Optional[str] = None):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.idf = idf
+        self.doclen = doclen
+        self.k1 = k1
+        self.b = b
+        self.prefix = prefix
+        self.avgdl = float(np.mean(doclen)) if len(doclen) else 0.0
+
+    @classmethod
+    def build(cls, texts: Iterable[str]) -> "BM25Index":
+        builder = BM25Builder()
+        for t in texts:
+            builder.add(t)
+        return builder.build()
+
+    def save(self, prefix: str = BM25_PATH):
+        paths = _paths(prefix)
+        for name in ARRAYS:
+            save_array(paths[name], np.asarray(getattr(self, name)))
+        with open(paths["vocab"], "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+        self.prefix = prefix
+
+    @classmethod
+    def load(cls, prefix: str = BM25_PATH, mmap: bool = True) -> Optional["BM25Index"]:
+        paths = _paths(prefix)
+        if not all(os.path.exists(p) for p in paths.values()):
+            return None
+        mode = "r" if mmap else None
+        arrays = {name: np.load(paths[name], mmap_mode=mode) for name in ARRAYS}
+        with open(paths["vocab"], "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        return cls(vocab, prefix=prefix, **arrays)
+
+    def __len__(self):
+        return len(self.doclen)
+
+    def search(self, query: str, k: int = 10, mask=None) -> List[Tuple[float, int]]:
+        """Return up to k (score, doc_id) pairs, best first.
+
+        ``mask`` is an optional boolean array over doc ids; other docs are ignored.
+        """
+        scores = np.zeros(len(self.doclen), dtype=np.float32)
+        avgdl = max(self.avgdl, 1e-9)
+        for term in set(tokenize(query)):
+            tid = self.vocab.get(term)
+            if tid is None:
+                continue
+            lo, hi = int(self.offsets[tid]), int(self.offsets[tid + 1])
+            docs = self.docs[lo:hi]
+            tfs = self.tfs[lo:hi]
+            norm = self.k1 * (1 - self.b + self.b * self.doclen[docs] / avgdl)
+            scores[docs] += self.idf[tid] * tfs * (self.k1 + 1) / (tfs + norm)
+        if mask is not None:
+            scores[~mask] = 0
+        hits = np.flatnonzero(scores)
+        if len(hits) == 0:
+            return []
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(float(scores[i]), int(i)) for i in hits]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = 60) -> List[Tuple[float, int]]:
+    """Fuse ranked id lists: score(d) = sum over lists of 1 / (k + rank)."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(((s, d) for d, s in fused.items()), key=lambda x: -x[0])
@@ -0,0 +1,166 @@
+"""Append-only chunk metadata stored as JSON lines.
+
+Records are written one at a time while the index is being built, so the
+builder never holds the whole corpus in memory. A small ``.idx.npy`` file
+of byte offsets next to the data gives random access by FAISS id. Readers
+map both files read-only, so several server processes share one copy in
+the page cache.
+"""
+import os
+import json
+import mmap
+import pickle
+from array import array
+
+import numpy as np
+
+
+def offsets_path(path: str) -> str:
+    return path + ".idx.npy"
+
+
+def sources_path(path: str) -> str:
+    return path + ".sources.json"
+
+
+def replace_file(path: str, write):
+    """Call ``write(tmp_path)``, then rename the result over ``path``.
+
+    Server processes may have ``path`` mapped read-only; truncating it in
+    place under them can crash them (SIGBUS) or return garbage, while a
+    rename leaves their mapping on the old file.
+    """
+    tmp = path + ".tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def save_array(path: str, arr):
+    # through a file object: np.save would append ".npy" to the temporary name
+    def write(tmp):
+        with open(tmp, "wb") as f:
+            np.save(f, arr)
+    replace_file(path, write)
+
+
+def _add_to_ranges(ranges: dict, meta: dict, i: int):
+    # chunks of one file are ingested together, so ids form a few [start, end) runs
+    source = meta.get("source") if isinstance(meta, dict) else None
+    if not isinstance(source, dict) or source.get("file") is None:
+        return
+    runs = ranges.setdefault(source["file"], [])
+    if runs and runs[-1][1] == i:
+        runs[-1][1] = i + 1
+    else:
+        runs.append([i, i + 1])
+
+
+def source_ranges(metadatas) -> dict:
+    """Map each source file to the id ranges of its chunks."""
+    cached = getattr(metadatas, "source_ranges", None)
+    if callable(cached):
+        return cached()
+    ranges = {}
+    for i, meta in enumerate(metadatas):
+        _add_to_ranges(ranges, meta, i)
+    return ranges
+
+
+class MetadataWriter:
+    def __init__(self, path: str):
+        self.path = path
+        self._tmp = path + ".tmp"
+        self._fh = open(self._tmp, "wb")
+        self._offsets = array("q")
+        self._ranges = {}
+
+    def append(self, meta: dict):
+        _add_to_ranges(self._ranges, meta, len(self._offsets))
+        self._offsets.append(self._fh.tell())
+        self._fh.write(json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+        self._fh.write(b"\n")
+
+    def extend(self, metas):
+        for m in metas:
+            self.append(m)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def close(self):
+        self._fh.close()
+        save_array(offsets_path(self.path), np.frombuffer(self._offsets, dtype=np.int64))
+        with open(sources_path(self.path), "w", encoding="utf-8") as f:
+            json.dump(self._ranges, f, ensure_ascii=False)
+        os.replace(self._tmp, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._fh.close()
+            os.remove(self._tmp)
+
+
+class MetadataReader:
+    """Read-only, list-like view over a file written by MetadataWriter."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._offsets = np.load(offsets_path(path), mmap_mode="r")
+        with open(path, "rb") as fh:
+            size = os.fstat(fh.fileno()).st_size
+            # mmap rejects empty files; an empty index has nothing to read anyway
+            self._data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._ranges = None
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        start = int(self._offsets[i])
+        # slicing the map is stateless, so lookups are safe from any thread
+        end = self._data.find(b"\n", start)
+        return json.loads(self._data[start:end])
+
+    def __iter__(self):
+        with open(self.path, "rb") as fh:
+            for line in fh:
+                yield json.loads(line)
+
+    def source_ranges(self) -> dict:
+        if self._ranges is None:
+            if os.path.exists(sources_path(self.path)):
+                with open(sources_path(self.path), "r", encoding="utf-8") as f:
+                    self._ranges = json.load(f)
+            else:
+                self._ranges = {}
+                for i, meta in enumerate(self):
+                    _add_to_ranges(self._ranges, meta, i)
+        return self._ranges
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+
+def write_metadata(metas, path: str):
+    with MetadataWriter(path) as w:
+        w.extend(metas)
+
+
+def load_metadata(path: str, legacy_path: str = None):
+    """Open ``path`` if present, else fall back to a legacy pickled list."""
+    if os.path.exists(path) and os.path.exists(offsets_path(path)):
+        return MetadataReader(path)
+    if legacy_path and os.path.exists(legacy_path):
+        with open(legacy_path, "rb") as f:
+            return pickle.load(f)
+    return None
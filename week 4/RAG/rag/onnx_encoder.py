@@ -0,0 +1,97 @@
+"""CPU query encoder running an exported sentence-transformers model in onnxruntime.
+
+Needs only ``onnxruntime`` and ``tokenizers`` at serve time, so RAG workers
+can answer queries without importing torch. Export once with:
+
+    python rag/onnx_encoder.py onnx-model [--model all-MiniLM-L6-v2] [--no-quantize]
+
+which writes model.onnx, an int8 dynamically-quantized model_quantized.onnx
+and tokenizer.json. Point EMBED_ONNX_DIR at that directory and set
+EMBED_BACKEND=onnx. Pooling matches all-MiniLM-L6-v2: attention-masked mean
+followed by L2 normalization.
+"""
+import os
+import argparse
+from typing import List
+
+import numpy as np
+
+MODEL_FILE = "model.onnx"
+QUANTIZED_FILE = "model_quantized.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+
+
+class OnnxEncoder:
+    def __init__(self, model_dir: str, max_length: int = 256, threads: int = 0,
+                 prefer_quantized: bool = True, normalize: bool = True):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        path = os.path.join(model_dir, QUANTIZED_FILE)
+        if not prefer_quantized or not os.path.exists(path):
+            path = os.path.join(model_dir, MODEL_FILE)
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = threads
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding()
+        self.normalize = normalize
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        encs = self.tokenizer.encode_batch(texts)
+        ids = np.array([e.ids for e in encs], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in encs], dtype=np.int64)
+        feed = {
+            "input_ids": ids,
+            "attention_mask": mask,
+            "token_type_ids": np.array([e.type_ids for e in encs], dtype=np.int64),
+        }
+        feed = {k: v for k, v in feed.items() if k in self.input_names}
+        hidden = self.session.run(None, feed)[0]
+
+        m = mask[..., None].astype(np.float32)
+        emb = (hidden * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            emb /= np.clip(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12, None)
+        return emb.astype(np.float32, copy=False)
+
+
+def export_onnx(model_name: str, out_dir: str, quantize: bool = True):
+    """Export the transformer body to ONNX (needs torch + transformers, build time only)."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    repo = model_name if "/" in model_name else "sentence-transformers/" + model_name
+    os.makedirs(out_dir, exist_ok=True)
+    tok = AutoTokenizer.from_pretrained(repo)
+    model = AutoModel.from_pretrained(repo).eval()
+    tok.save_pretrained(out_dir)
+
+    sample = tok(["export sample"], return_tensors="pt")
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+    axes = {n: {0: "batch", 1: "seq"} for n in names}
+    axes["last_hidden_state"] = {0: "batch", 1: "seq"}
+    path = os.path.join(out_dir, MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(model, tuple(sample[n] for n in names), path,
+                          input_names=names, output_names=["last_hidden_state"],
+                          dynamic_axes=axes, opset_version=14)
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(path, os.path.join(out_dir, QUANTIZED_FILE), weight_type=QuantType.QInt8)
+    return path
+
+
+if __name__ == '__main__':
+    from embeddings import MODEL_NAME
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("out_dir")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--no-quantize", action="store_true")
+    args = parser.parse_args()
+    print("wrote", export_onnx(args.model, args.out_dir, quantize=not args.no_quantize))
@@ -0,0 +1,134 @@
+"""Multi-process embedding for large index rebuilds.
+
+Chunks are grouped into shards and each shard is encoded by a worker
+process holding its own copy of the model. Results are yielded back in
+shard order so the caller can add them to the index (and append the
+matching metadata) as soon as they arrive. Finished shards are written to
+a checkpoint directory so an interrupted build picks up where it stopped.
+"""
+import os
+import glob
+import hashlib
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from embeddings import MODEL_NAME
+
+# Per-process model, created once by _init_worker
+_worker_model = None
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+def _init_worker(model_name: str, threads: int):
+    # Pin thread pools before torch is imported so workers don't oversubscribe the CPU
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    from sentence_transformers import SentenceTransformer
+
+    global _worker_model
+    _worker_model = SentenceTransformer(model_name, device="cpu")
+
+
+def _encode_shard(texts: List[str], batch_size: int) -> np.ndarray:
+    vecs = _worker_model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+    return np.asarray(vecs, dtype=np.float32)
+
+
+def _checkpoint_path(checkpoint_dir: str, shard_id: int, texts: List[str]) -> str:
+    # Include a content hash so a changed corpus never resumes from stale vectors
+    h = hashlib.sha1()
+    for t in texts:
+        h.update(t.encode("utf-8"))
+        h.update(b"\0")
+    return os.path.join(checkpoint_dir, f"shard_{shard_id:06d}_{h.hexdigest()[:12]}.npy")
+
+
+def _save_checkpoint(ckpt: str, vecs: np.ndarray):
+    tmp = ckpt + ".tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, vecs)
+    os.replace(tmp, ckpt)
+
+
+def clear_checkpoints(checkpoint_dir: str):
+    """Delete the shard checkpoints in ``checkpoint_dir``; call once the index is saved."""
+    for path in glob.glob(os.path.join(checkpoint_dir, "shard_*.npy*")):
+        os.remove(path)
+
+
+def embed_shards(shards: Iterable[list], encode: Callable, checkpoint_dir: Optional[str] = None,
+                 text_of: Optional[Callable] = None) -> Iterator[Tuple[list, np.ndarray]]:
+    """Single-process counterpart of embed_shards_parallel, with the same checkpoints."""
+    if checkpoint_dir:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+    for shard_id, shard in enumerate(shards):
+        if not shard:
+            continue
+        texts = [text_of(x) for x in shard] if text_of else shard
+        ckpt = _checkpoint_path(checkpoint_dir, shard_id, texts) if checkpoint_dir else None
+        if ckpt and os.path.exists(ckpt):
+            vecs = np.load(ckpt)
+        else:
+            vecs = encode(texts)
+            if ckpt:
+                _save_checkpoint(ckpt, vecs)
+        yield shard, vecs
+
+
+def embed_shards_parallel(shards: Iterable[list], workers: Optional[int] = None,
+                          model_name: str = MODEL_NAME, batch_size: int = 64,
+                          checkpoint_dir: Optional[str] = None,
+                          text_of: Optional[Callable] = None
+                          ) -> Iterator[Tuple[list, np.ndarray]]:
+    """Encode shards across worker processes, yielding (shard, vectors) in input order.
+
+    Shards are lists of strings, or of arbitrary items when ``text_of`` maps
+    each item to its text. At most ``2 * workers`` shards are in flight, so
+    memory stays bounded even when ``shards`` is a lazy generator over a
+    large corpus.
+    """
+    workers = workers or os.cpu_count() or 1
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    if checkpoint_dir:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    # spawn: never fork a parent that may already hold torch/OpenMP state
+    ctx = multiprocessing.get_context("spawn")
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=_init_worker, initargs=(model_name, threads)) as pool:
+
+        def drain_one():
+            shard, ckpt, fut = pending.popleft()
+            if fut is None:
+                vecs = np.load(ckpt)
+            else:
+                vecs = fut.result()
+                if ckpt:
+                    _save_checkpoint(ckpt, vecs)
+            return shard, vecs
+
+        for shard_id, shard in enumerate(shards):
+            if not shard:
+                continue
+            texts = [text_of(x) for x in shard] if text_of else shard
+            ckpt = _checkpoint_path(checkpoint_dir, shard_id, texts) if checkpoint_dir else None
+            if ckpt and os.path.exists(ckpt):
+                pending.append((shard, ckpt, None))
+            else:
+                pending.append((shard, ckpt, pool.submit(_encode_shard, texts, batch_size)))
+            while len(pending) >= 2 * workers:
+                yield drain_one()
+        while pending:
+            yield drain_one()
@@ -0,0 +1,97 @@
+"""Cross-encoder reranking of retrieved candidates under a latency budget.
+
+Candidates are scored in retrieval order, in batches. Before each batch
+the reranker estimates its cost from the measured per-pair time and, if the
+deadline would be missed, shrinks the batch or stops; candidates left
+unscored keep their retrieval order behind the reranked ones. Scores are
+cached per (query, chunk id) so repeated questions skip the model.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+RERANK_MODEL = os.environ.get("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+DEFAULT_RERANK_CANDIDATES = 20
+
+
+class Reranker:
+    def __init__(self, model_name: str = RERANK_MODEL, batch_size: int = 8,
+                 cache_size: int = 4096, max_length: int = 256):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.max_length = max_length
+        self._model = None
+        self._cache: "OrderedDict[Tuple[str, int], float]" = OrderedDict()
+        # moving average of seconds per scored pair, None until measured
+        self.pair_cost: Optional[float] = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            from sentence_transformers import CrossEncoder
+            self._model = CrossEncoder(self.model_name, max_length=self.max_length)
+        return self._model
+
+    def warmup(self):
+        """Load the model and take a first timing so the budget check is informed.
+
+        The first prediction (lazy initialization inside the model) is not
+        timed; the timing comes from a second, full batch.
+        """
+        self.model.predict([("warmup", "warmup")], show_progress_bar=False)
+        self._score([("warmup", "warmup")] * self.batch_size)
+
+    def _score(self, pairs):
+        model = self.model  # loaded outside the timing
+        t0 = time.perf_counter()
+        scores = model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+        per_pair = (time.perf_counter() - t0) / len(pairs)
+        self.pair_cost = per_pair if self.pair_cost is None else 0.8 * self.pair_cost + 0.2 * per_pair
+        return [float(s) for s in scores]
+
+    def _cache_put(self, key, score):
+        self._cache[key] = score
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def rerank(self, query: str, candidates: Sequence[Tuple[int, str]], k: int,
+               budget_ms: Optional[float] = None) -> List[Tuple[int, Optional[float]]]:
+        """Order (chunk_id, text) candidates; returns up to k (chunk_id, score) pairs.
+
+        ``score`` is the cross-encoder score, or None for candidates that the
+        budget did not allow to be scored.
+        """
+        deadline = time.perf_counter() + budget_ms / 1000.0 if budget_ms is not None else None
+        scores = {}
+        todo = []
+        for cid, text in candidates:
+            cached = self._cache.get((query, cid))
+            if cached is not None:
+                self._cache.move_to_end((query, cid))
+                scores[cid] = cached
+            else:
+                todo.append((cid, text))
+
+        pos = 0
+        while pos < len(todo):
+            n = self.batch_size
+            if deadline is not None:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                if self.pair_cost:
+                    n = min(n, int(remaining / self.pair_cost))
+                    if n < 1:
+                        break
+            batch = todo[pos:pos + n]
+            for (cid, _), s in zip(batch, self._score([(query, t) for _, t in batch])):
+                scores[cid] = s
+                self._cache_put((query, cid), s)
+            pos += len(batch)
+
+        scored = sorted((cid for cid, _ in candidates if cid in scores), key=lambda c: -scores[c])
+        unscored = [cid for cid, _ in candidates if cid not in scores]
+        return [(cid, scores.get(cid)) for cid in (scored + unscored)[:k]]
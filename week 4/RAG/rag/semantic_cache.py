@@ -0,0 +1,79 @@
+"""Semantic answer cache keyed by query embedding.
+
+Recent query vectors are kept L2-normalized in a fixed-size ring buffer,
+and a lookup is one matrix-vector product over it. At a few thousand
+entries that is exact and as fast as an ANN index, and expired slots are
+simply overwritten. A cached answer is returned when the cosine similarity
+to a new query is at least ``threshold``, the entry has not expired, it was
+stored under the same index version and the same extra key (e.g. a source
+filter).
+"""
+import time
+import threading
+from typing import Any, Hashable, Optional
+
+import numpy as np
+
+
+class SemanticCache:
+    def __init__(self, threshold: float = 0.95, ttl: float = 600.0, max_entries: int = 2048):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version: Optional[str] = None
+        self._vecs = None
+        self._expires = np.zeros(max_entries, dtype=np.float64)
+        self._entries = [None] * max_entries
+        self._next = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def set_version(self, version: str):
+        """Drop everything cached for a different index version."""
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                self._expires[:] = 0
+                self._entries = [None] * self.max_entries
+
+    @staticmethod
+    def _normalize(qvec) -> np.ndarray:
+        v = np.asarray(qvec, dtype=np.float32).reshape(-1)
+        n = np.linalg.norm(v)
+        return v / n if n > 0 else v
+
+    def get(self, qvec, key: Hashable = None) -> Optional[Any]:
+        v = self._normalize(qvec)
+        now = time.monotonic()
+        with self._lock:
+            if self._vecs is None:
+                self.misses += 1
+                return None
+            sims = self._vecs @ v
+            sims[self._expires <= now] = -np.inf
+            for i in np.argsort(-sims)[:8]:
+                if sims[i] < self.threshold:
+                    break
+                entry_key, answer = self._entries[i]
+                if entry_key == key:
+                    self.hits += 1
+                    return answer
+            self.misses += 1
+            return None
+
+    def put(self, qvec, answer: Any, key: Hashable = None):
+        v = self._normalize(qvec)
+        with self._lock:
+            if self._vecs is None:
+                self._vecs = np.zeros((self.max_entries, v.shape[0]), dtype=np.float32)
+            i = self._next
+            self._vecs[i] = v
+            self._expires[i] = time.monotonic() + self.ttl
+            self._entries[i] = (key, answer)
+            self._next = (i + 1) % self.max_entries
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0, "version": self.version}
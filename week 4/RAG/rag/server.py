@@ -1,7 +1,9 @@
+from typing import List, Optional
 from fastapi import FastAPI, Query
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from rag.cli import build_or_load_index, answer_query
+from rag.cli import build_or_load_index, load_index, answer_query
+import os
 import uvicorn
 
 app = FastAPI()
@@ -15,6 +17,22 @@ app.add_middleware(
 
 store = None
 BOOK_DIR = "typescript-book"
+# Map the prebuilt index read-only so uvicorn workers share one copy in page cache
+RAG_MMAP = os.environ.get("RAG_MMAP", "1") == "1"
+RAG_WORKERS = int(os.environ.get("RAG_WORKERS", "1"))
+# Serve a sharded index (see rag/sharding.py) instead of the single one
+RAG_SHARDS = int(os.environ.get("RAG_SHARDS", "0"))
+# Optional cross-encoder stage; skipped or shrunk when it would exceed the budget
+RAG_RERANK = os.environ.get("RAG_RERANK") == "1"
+RAG_RERANK_CANDIDATES = int(os.environ.get("RAG_RERANK_CANDIDATES", "20"))
+RAG_RERANK_BUDGET_MS = float(os.environ.get("RAG_RERANK_BUDGET_MS", "150"))
+reranker = None
+# Semantic answer cache: paraphrased questions reuse an earlier answer
+RAG_SEMANTIC_CACHE = os.environ.get("RAG_SEMANTIC_CACHE", "1") == "1"
+RAG_CACHE_THRESHOLD = float(os.environ.get("RAG_CACHE_THRESHOLD", "0.95"))
+RAG_CACHE_TTL = float(os.environ.get("RAG_CACHE_TTL", "600"))
+RAG_CACHE_SIZE = int(os.environ.get("RAG_CACHE_SIZE", "2048"))
+answer_cache = None
 
 class SearchResponse(BaseModel):
     answer: str
@@ -23,13 +41,41 @@ class SearchResponse(BaseModel):
 
 @app.on_event("startup")
 async def startup_event():
-    global store
-    store = build_or_load_index(BOOK_DIR)
+    global store, reranker, answer_cache
+    # mapped files are shared by the workers, which must not build or migrate
+    # them concurrently: with RAG_MMAP the index has to exist already
+    if RAG_SHARDS:
+        from rag.sharding import build_or_load_sharded, load_sharded
+        store = load_sharded(RAG_SHARDS, mmap=True) if RAG_MMAP else build_or_load_sharded(BOOK_DIR, RAG_SHARDS)
+    else:
+        store = load_index(mmap=True) if RAG_MMAP else build_or_load_index(BOOK_DIR)
+    if RAG_RERANK:
+        from rag.rerank import Reranker
+        reranker = Reranker()
+        # load the model now so the first request's budget isn't spent on it
+        reranker.warmup()
+    if RAG_SEMANTIC_CACHE:
+        from rag.semantic_cache import SemanticCache
+        answer_cache = SemanticCache(RAG_CACHE_THRESHOLD, RAG_CACHE_TTL, RAG_CACHE_SIZE)
+        answer_cache.set_version(store.version)
 
 
 @app.get("/search", response_model=SearchResponse)
-async def search(q: str = Query(..., min_length=1)):
-    snippets = answer_query(store, q)
+async def search(q: str = Query(..., min_length=1),
+                 source: Optional[List[str]] = Query(None, description="file pattern or directory to search in")):
+    # the answer heuristics below depend on these, so paraphrases must agree on them too
+    flags = ('=>' in q or 'arrow' in q.lower(), '!!' in q or 'boolean' in q.lower())
+    cache_key = (flags, tuple(source or ()))
+    qvec = None
+    if answer_cache is not None:
+        # the store keeps recent query embeddings, so answer_query won't re-encode this
+        qvec = getattr(store, "encoder", store).encode_query(q)
+        answer_cache.set_version(store.version)
+        cached = answer_cache.get(qvec, cache_key)
+        if cached is not None:
+            return cached
+    snippets = answer_query(store, q, reranker=reranker, rerank_candidates=RAG_RERANK_CANDIDATES,
+                            budget_ms=RAG_RERANK_BUDGET_MS, sources=source)
     # Construct answer: try to find exact phrases for common patterns
     answer_text = ""
     if '=>' in q or 'arrow' in q.lower():
@@ -50,8 +96,15 @@ async def search(q: str = Query(..., min_length=1)):
         else:
             answer_text = "No relevant excerpt found."
     sources = [s.get('source') for s in snippets]
-    return {"answer": answer_text, "sources": sources}
+    result = {"answer": answer_text, "sources": sources}
+    if answer_cache is not None:
+        answer_cache.put(qvec, result, cache_key)
+    return result
 
 
 if __name__ == '__main__':
-    uvicorn.run(app, host='0.0.0.0', port=8000)
+    if RAG_WORKERS > 1:
+        # workers are separate processes, so uvicorn needs the import string
+        uvicorn.run("rag.server:app", host='0.0.0.0', port=8000, workers=RAG_WORKERS)
+    else:
+        uvicorn.run(app, host='0.0.0.0', port=8000)
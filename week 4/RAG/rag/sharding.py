@@ -0,0 +1,210 @@
+"""Sharded vector index with parallel fan-out search.
+
+Chunks are assigned to shards by a hash of their source file, and each
+shard is a complete EmbeddingStore (FAISS index, metadata, BM25) saved in
+its own directory, so shards can be built independently, in separate
+processes or on separate machines:
+
+    python rag/cli.py --reindex --shards 4 --shard-id 0   # ... 1, 2, 3
+
+A query is encoded once and searched on every shard from a thread pool
+(FAISS releases the GIL during search), then the per-shard top-k lists are
+merged. Global chunk ids pack the shard number into the high bits, so
+``store.metadatas[i]`` works the same as for a single EmbeddingStore.
+"""
+import os
+import heapq
+import hashlib
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+
+from embeddings import EmbeddingStore, MODEL_NAME, QUANTIZATION, METRIC, DEFAULT_CANDIDATES
+from lexical import reciprocal_rank_fusion
+
+SHARD_DIR = "rag_shards"
+SHARD_BITS = 40
+LOCAL_MASK = (1 << SHARD_BITS) - 1
+
+
+def shard_of(source_file: str, n_shards: int) -> int:
+    # normalise separators so Windows and POSIX builds agree on placement
+    key = source_file.replace("\\", "/").encode("utf-8")
+    return int(hashlib.sha1(key).hexdigest()[:8], 16) % n_shards
+
+
+def shard_paths(shard_dir: str, shard_id: int) -> dict:
+    d = os.path.join(shard_dir, f"shard_{shard_id:03d}")
+    return {
+        "index_path": os.path.join(d, "index.faiss"),
+        "meta_path": os.path.join(d, "meta.jsonl"),
+        "bm25_path": os.path.join(d, "bm25"),
+    }
+
+
+def empty_marker(shard_dir: str, shard_id: int) -> str:
+    # written for a shard no file hashes to, so it isn't mistaken for one not built yet
+    return os.path.join(shard_dir, f"shard_{shard_id:03d}", "EMPTY")
+
+
+def build_shard(book_dir: str, shard_id: int, n_shards: int, shard_dir: str = SHARD_DIR,
+                quantization=QUANTIZATION, metric=METRIC, **kwargs):
+    """Index only the files that hash to ``shard_id``; returns (chunks, files).
+
+    A shard with no chunks gets an EMPTY marker instead of an index.
+    """
+    from cli import iter_markdown_files, iter_documents, iter_chunks, index_chunks
+
+    paths = shard_paths(shard_dir, shard_id)
+    os.makedirs(os.path.dirname(paths["index_path"]), exist_ok=True)
+    marker = empty_marker(shard_dir, shard_id)
+    files = (f for f in iter_markdown_files(book_dir)
+             if shard_of(os.path.relpath(f, book_dir), n_shards) == shard_id)
+    chunks = iter_chunks(iter_documents(files), book_dir)
+    first = next(chunks, None)
+    if first is None:
+        if os.path.exists(paths["index_path"]):
+            # left over from a build where files did hash here
+            os.remove(paths["index_path"])
+        open(marker, "w").close()
+        return 0, 0
+    if os.path.exists(marker):
+        os.remove(marker)
+    if kwargs.get("checkpoint_dir"):
+        # one subdirectory per shard, so finishing one shard only clears its own checkpoints
+        kwargs["checkpoint_dir"] = os.path.join(kwargs["checkpoint_dir"], f"shard_{shard_id:03d}")
+    store = EmbeddingStore(quantization=quantization, metric=metric)
+    return index_chunks(store, itertools.chain([first], chunks), **paths, **kwargs)
+
+
+class ShardedMetadata:
+    def __init__(self, shards: List[EmbeddingStore]):
+        self.shards = shards
+
+    def __len__(self):
+        return sum(len(s.metadatas) for s in self.shards)
+
+    def __getitem__(self, gid: int):
+        return self.shards[gid >> SHARD_BITS].metadatas[gid & LOCAL_MASK]
+
+
+class ShardedEmbeddingStore:
+    def __init__(self, n_shards: int, shard_dir: str = SHARD_DIR, model_name: str = MODEL_NAME,
+                 quantization=QUANTIZATION, metric=METRIC):
+        self.shard_dir = shard_dir
+        self.shards = [EmbeddingStore(model_name, quantization=quantization, metric=metric)
+                       for _ in range(n_shards)]
+        # only the first store ever loads a model; it encodes queries for all shards
+        self.encoder = self.shards[0]
+        self.metadatas = ShardedMetadata(self.shards)
+        self.version = None
+        # shards with neither an index nor an EMPTY marker after load()
+        self.missing: List[int] = []
+        self._pool = ThreadPoolExecutor(max_workers=n_shards, thread_name_prefix="shard")
+
+    def load(self, mmap=False) -> bool:
+        """Load every shard; True only when each one has an index or is
+        marked empty (the others are listed in ``missing``)."""
+        self.missing = []
+        for i, s in enumerate(self.shards):
+            s.index = None
+            if os.path.exists(empty_marker(self.shard_dir, i)):
+                continue
+            if not s.load(mmap=mmap, **shard_paths(self.shard_dir, i)):
+                self.missing.append(i)
+        self.version = "/".join(str(s.version) for s in self.shards)
+        return not self.missing
+
+    def _live(self):
+        # a shard that no file hashed to has no index; skip it
+        return [(i, s) for i, s in enumerate(self.shards) if s.index is not None]
+
+    def search_vector(self, qvec, k=3, sources=None):
+        def one(item):
+            i, s = item
+            D, I = s.search_vector(qvec, k, sources=sources)
+            return [(float(d), (i << SHARD_BITS) | int(j)) for d, j in zip(D, I)]
+
+        live = self._live()
+        # distances merge smallest-first, cosine similarities largest-first
+        best = heapq.nlargest if live and live[0][1].metric == "cosine" else heapq.nsmallest
+        merged = best(k, (hit for hits in self._pool.map(one, live) for hit in hits))
+        D = np.array([d for d, _ in merged], dtype=np.float32)
+        I = np.array([g for _, g in merged], dtype=np.int64)
+        return D, I
+
+    def search(self, query: str, k=3, sources=None):
+        return self.search_vector(self.encoder.encode_query(query), k, sources=sources)
+
+    def _lexical_search(self, query: str, k: int, sources=None) -> List[int]:
+        def one(item):
+            i, s = item
+            if s.lexical is None:
+                return []
+            mask = s.source_mask(sources) if sources is not None else None
+            return [(score, (i << SHARD_BITS) | j) for score, j in s.lexical.search(query, k, mask=mask)]
+
+        # BM25 idf is per shard, so cross-shard scores are approximate
+        merged = heapq.nlargest(k, (hit for hits in self._pool.map(one, self._live()) for hit in hits))
+        return [g for _, g in merged]
+
+    def retrieve(self, query: str, k=3, hybrid=False, candidates=DEFAULT_CANDIDATES,
+                 sources=None) -> List[Tuple[float, int]]:
+        """Same contract as EmbeddingStore.retrieve, over all shards."""
+        qvec = self.encoder.encode_query(query)
+        if not hybrid:
+            D, I = self.search_vector(qvec, k, sources=sources)
+            return [(float(d), int(i)) for d, i in zip(D, I)]
+        candidates = max(candidates, k)
+        # each call fans out over the pool itself; nesting them could starve it
+        _, dense_ids = self.search_vector(qvec, candidates, sources=sources)
+        lexical_ids = self._lexical_search(query, candidates, sources)
+        fused = reciprocal_rank_fusion([[int(i) for i in dense_ids], lexical_ids])
+        return fused[:k]
+
+    def query(self, query: str, k=3, sources=None):
+        return [(score, self.metadatas[i]) for score, i in self.retrieve(query, k, sources=sources)]
+
+    def hybrid_query(self, query: str, k=3, candidates=DEFAULT_CANDIDATES, sources=None):
+        hits = self.retrieve(query, k, hybrid=True, candidates=candidates, sources=sources)
+        return [(score, self.metadatas[i]) for score, i in hits]
+
+
+def load_sharded(n_shards: int, shard_dir: str = SHARD_DIR, mmap=False) -> ShardedEmbeddingStore:
+    """Load every shard without building any; see cli.load_index."""
+    store = ShardedEmbeddingStore(n_shards, shard_dir=shard_dir)
+    if not store.load(mmap=mmap):
+        raise RuntimeError(f"Shards {store.missing} of {shard_dir} are not built; build them first with: "
+                           f"python -m rag.cli --reindex --shards {n_shards}")
+    if any(s.lexical is None for _, s in store._live()):
+        raise RuntimeError(f"Shards in {shard_dir} were saved without BM25; rebuild them with: "
+                           f"python -m rag.cli --reindex --shards {n_shards}")
+    return store
+
+
+def build_or_load_sharded(book_dir: str, n_shards: int, force_reindex=False, shard_dir: str = SHARD_DIR,
+                          quantization=QUANTIZATION, mmap=False, metric=METRIC,
+                          **kwargs) -> ShardedEmbeddingStore:
+    store = ShardedEmbeddingStore(n_shards, shard_dir=shard_dir, quantization=quantization, metric=metric)
+    if not force_reindex and store.load(mmap=mmap):
+        print(f"Loaded {n_shards} shards")
+        if not mmap:
+            # as for a single index: re-encode stored vectors, no re-embedding
+            for i, s in store._live():
+                if s.convert(quantization, metric):
+                    s.save(**shard_paths(shard_dir, i))
+                    print(f"shard {i}: converted index to {s.quantization or 'float32'}, {s.metric}")
+        return store
+    # a full rebuild, or only the shards that were never built (e.g. --shard-id runs left out)
+    todo = range(n_shards) if force_reindex else store.missing
+    if not force_reindex:
+        print(f"Shards {', '.join(map(str, todo))} of {n_shards} not built yet; building them")
+    for i in todo:
+        n_chunks, n_files = build_shard(book_dir, i, n_shards, shard_dir=shard_dir,
+                                        quantization=quantization, metric=metric, **kwargs)
+        print(f"shard {i}: indexed {n_chunks} chunks from {n_files} files" if n_chunks else f"shard {i}: no files")
+    if not store.load(mmap=mmap):
+        raise RuntimeError(f"shards {store.missing} of {shard_dir} could not be loaded")
+    return store
@@ -0,0 +1,212 @@
+import time
+import zlib
+
+import numpy as np
+import pytest
+
+import cli
+from chunking import chunk_text, FALLBACK_MAX_CHARS
+from embeddings import EmbeddingStore
+from lexical import BM25Index, reciprocal_rank_fusion, tokenize
+from metastore import MetadataReader, write_metadata, source_ranges
+from rerank import Reranker
+from semantic_cache import SemanticCache
+
+DIM = 64
+
+
+def stub_encode(texts, **kwargs):
+    """Bag-of-words vectors: each token adds 1 to a dimension picked by its crc32."""
+    vecs = np.zeros((len(texts), DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for token in tokenize(text):
+            vecs[row, zlib.crc32(token.encode("utf-8")) % DIM] += 1.0
+    return vecs
+
+
+def stub_store(tmp_path, chunks, metric="cosine"):
+    store = EmbeddingStore(quantization=None, metric=metric)
+    store.encode = stub_encode
+    paths = {"meta_path": str(tmp_path / "meta.jsonl"), "index_path": str(tmp_path / "index.faiss"),
+             "bm25_path": str(tmp_path / "bm25")}
+    cli.index_chunks(store, chunks, batch_size=2, **paths)
+    return store, paths
+
+
+CHUNKS = [
+    ("interfaces describe the shape of an object", {"file": "docs/types/interfaces.md", "chunk": 0}),
+    ("type aliases name any type", {"file": "docs/types/aliases.md", "chunk": 0}),
+    ("generics let functions work over many types", {"file": "docs/generics.md", "chunk": 0}),
+    ("an interface can extend another interface", {"file": "docs/types/interfaces.md", "chunk": 1}),
+    ("promises and async functions", {"file": "docs/async.md", "chunk": 0}),
+]
+
+
+def test_bm25_ranks_by_term_weight():
+    index = BM25Index.build(["the cat sat", "the dog sat", "cat cat cat", "nothing here"])
+    hits = index.search("cat", k=10)
+    assert [d for _, d in hits] == [2, 0]
+    assert hits[0][0] > hits[1][0] > 0
+    assert index.search("unknown", k=10) == []
+    mask = np.array([True, True, False, True])
+    assert [d for _, d in index.search("cat", k=10, mask=mask)] == [0]
+
+
+def test_bm25_save_and_load(tmp_path):
+    index = BM25Index.build(["alpha beta", "beta gamma", "gamma delta"])
+    index.save(str(tmp_path / "bm25"))
+    loaded = BM25Index.load(str(tmp_path / "bm25"))
+    assert len(loaded) == 3
+    assert loaded.search("gamma", k=2) == index.search("gamma", k=2)
+    assert BM25Index.load(str(tmp_path / "missing")) is None
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1, 4]], k=60)
+    ids = [d for _, d in fused]
+    assert ids[0] == 1 and set(ids) == {1, 2, 3, 4}
+    assert fused[0][0] == pytest.approx(1 / 61 + 1 / 62)
+
+
+def test_metadata_round_trip_and_source_ranges(tmp_path):
+    metas = [{"text": t, "source": s} for t, s in CHUNKS]
+    path = str(tmp_path / "meta.jsonl")
+    write_metadata(metas, path)
+    reader = MetadataReader(path)
+    assert len(reader) == len(metas)
+    assert reader[1] == metas[1] and reader[-1] == metas[-1]
+    assert reader[1:3] == metas[1:3]
+    assert list(reader) == metas
+    ranges = {"docs/types/interfaces.md": [[0, 1], [3, 4]], "docs/types/aliases.md": [[1, 2]],
+              "docs/generics.md": [[2, 3]], "docs/async.md": [[4, 5]]}
+    assert reader.source_ranges() == ranges
+    # the same ranges when computed from a plain list
+    assert source_ranges(metas) == ranges
+    reader.close()
+
+
+def test_index_chunks_retrieves_and_filters_by_source(tmp_path):
+    store, paths = stub_store(tmp_path, CHUNKS)
+    assert store.index.ntotal == len(CHUNKS)
+    top = store.retrieve("interface extend", k=1)
+    assert top[0][1] == 3
+    filtered = store.retrieve("generics functions", k=5, sources="docs/types")
+    assert sorted(i for _, i in filtered) == [0, 1, 3]
+    assert store.source_mask("docs/types/*.md").tolist() == [True, True, False, True, False]
+    assert store.source_mask(["docs/async.md", "docs/generics.md"]).tolist() == \
+        [False, False, True, False, True]
+    assert store.retrieve("promises", k=3, sources="missing/") == []
+
+    loaded = EmbeddingStore(quantization=None)
+    loaded.encode = stub_encode
+    assert loaded.load(**paths, mmap=True)
+    assert loaded.metric == "cosine" and len(loaded.metadatas) == len(CHUNKS)
+    hybrid = loaded.retrieve("async promises", k=2, hybrid=True, sources=["docs/async.md"])
+    assert [i for _, i in hybrid] == [4]
+
+
+def test_chunk_text_windows_overlap_and_headings():
+    words = [f"w{i}" for i in range(100)]
+    text = "# Title\n" + " ".join(words)
+    chunks = chunk_text(text, max_tokens=20, overlap=10, tokenizer=None)
+    assert len(chunks) > 1
+    assert all(c.startswith("# Title\n") for c in chunks)
+    bodies = [c.split("\n", 1)[1].split() for c in chunks]
+    # every word is covered, in order, and consecutive windows share words
+    assert bodies[0][0] == "w0" and bodies[-1][-1] == "w99"
+    for prev, cur in zip(bodies, bodies[1:]):
+        assert cur[0] in prev and words.index(cur[0]) > words.index(prev[0])
+
+
+def test_chunk_text_splits_sections_and_skips_empty_ones():
+    text = "intro text\n# A\nalpha body\n## B\n\n# C\ngamma body"
+    assert chunk_text(text, tokenizer=None) == ["intro text", "# A\nalpha body", "# C\ngamma body"]
+
+
+def test_chunk_text_fallback_caps_characters():
+    # one long token-free run must still be split into bounded chunks
+    text = "x" * 5000 + " tail"
+    chunks = chunk_text(text, tokenizer=None)
+    assert len(chunks) > 1
+    assert all(len(c) <= FALLBACK_MAX_CHARS for c in chunks)
+    assert chunks[-1].endswith("tail")
+
+
+def test_semantic_cache_threshold_key_and_version():
+    cache = SemanticCache(threshold=0.9, ttl=60, max_entries=4)
+    cache.set_version("v1")
+    cache.put([1.0, 0.0], "east", key="docs")
+    assert cache.get([2.0, 0.1], key="docs") == "east"
+    assert cache.get([1.0, 1.0], key="docs") is None
+    assert cache.get([1.0, 0.0], key="other") is None
+    cache.set_version("v1")
+    assert cache.get([1.0, 0.0], key="docs") == "east"
+    cache.set_version("v2")
+    assert cache.get([1.0, 0.0], key="docs") is None
+    assert cache.stats() == {"hits": 2, "misses": 3, "hit_rate": 0.4, "version": "v2"}
+
+
+def test_semantic_cache_expires_and_wraps():
+    cache = SemanticCache(threshold=0.9, ttl=0, max_entries=2)
+    cache.put([1.0, 0.0], "stale")
+    assert cache.get([1.0, 0.0]) is None
+    cache = SemanticCache(threshold=0.9, ttl=60, max_entries=2)
+    for i, v in enumerate([[1.0, 0.0], [0.0, 1.0], [-1.0, 0.0]]):
+        cache.put(v, i)
+    # the third entry overwrote the oldest slot
+    assert cache.get([1.0, 0.0]) is None
+    assert cache.get([0.0, 1.0]) == 1 and cache.get([-1.0, 0.0]) == 2
+
+
+class FakeCrossEncoder:
+    """Scores a pair by the length of its text, taking ``delay`` seconds per pair;
+    records every batch."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batches = []
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        self.batches.append(list(pairs))
+        time.sleep(self.delay * len(pairs))
+        return [float(len(t)) for _, t in pairs]
+
+
+def fake_reranker(batch_size=2, delay=0.0):
+    reranker = Reranker(batch_size=batch_size)
+    reranker._model = FakeCrossEncoder(delay)
+    return reranker
+
+
+CANDIDATES = [(10, "a"), (11, "ccc"), (12, "bb"), (13, "dddd")]
+
+
+def test_rerank_orders_by_score_and_caches():
+    reranker = fake_reranker()
+    assert reranker.rerank("q", CANDIDATES, k=3) == [(13, 4.0), (11, 3.0), (12, 2.0)]
+    assert len(reranker._model.batches) == 2
+    assert reranker.pair_cost is not None
+    reranker.rerank("q", CANDIDATES, k=3)
+    assert len(reranker._model.batches) == 2
+
+
+def test_rerank_stops_when_budget_is_spent():
+    reranker = fake_reranker()
+    # measured cost far above the budget: nothing is scored, retrieval order is kept
+    reranker.pair_cost = 1.0
+    assert reranker.rerank("q", CANDIDATES, k=4, budget_ms=50) == [(10, None), (11, None), (12, None),
+                                                                   (13, None)]
+    assert reranker._model.batches == []
+    # unmeasured, one batch runs; it overshoots the budget, so the rest stay unscored
+    reranker = fake_reranker(delay=0.05)
+    ranked = reranker.rerank("q", CANDIDATES, k=4, budget_ms=50)
+    assert ranked == [(11, 3.0), (10, 1.0), (12, None), (13, None)]
+    assert [len(b) for b in reranker._model.batches] == [2]
+
+
+def test_rerank_warmup_measures_pair_cost():
+    reranker = fake_reranker(batch_size=4)
+    reranker.warmup()
+    # the untimed first call and one timed full batch
+    assert [len(b) for b in reranker._model.batches] == [1, 4]
+    assert reranker.pair_cost is not None and reranker.pair_cost >= 0
@@ -0,0 +1,179 @@
+"""Named document collections embedded once and kept on disk.
+
+Each collection lives in its own directory under the store's root:
+
+    <root>/<name>/meta.json     model id, dimension, document count
+    <root>/<name>/docs.jsonl    one {"id", "text"} per line, in row order
+    <root>/<name>/vectors.npy   float32 (count, dim), rows L2-normalized
+
+Vectors are normalized when added, so scoring a query is one
+matrix-vector product. Files are written to temporaries and renamed into
+place; meta.json goes last and its count is checked on load.
+"""
+import os
+import re
+import json
+import shutil
+import hashlib
+from typing import Dict, List, Optional
+
+import numpy as np
+
+NAME_RE = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]{0,63}$")
+
+
+def doc_id(text: str) -> str:
+    """Default id of a document: a prefix of the sha256 of its text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def normalize_rows(vecs) -> np.ndarray:
+    """Scale rows (or a single vector) to unit length, as float32."""
+    vecs = np.asarray(vecs, dtype=np.float32)
+    norms = np.linalg.norm(vecs, axis=-1, keepdims=True)
+    # zero vectors stay zero, so their similarity to anything is 0
+    return vecs / np.where(norms == 0, 1, norms)
+
+
+def _replace(path: str, write):
+    tmp = path + ".tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+class DocumentCollection:
+    def __init__(self, name: str, model: str, ids: Optional[List[str]] = None,
+                 texts: Optional[List[str]] = None, vectors: Optional[np.ndarray] = None):
+        self.name = name
+        self.model = model
+        self.ids = list(ids or [])
+        self.texts = list(texts or [])
+        self.vectors = vectors
+        self._rows = {d: i for i, d in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, ids: List[str], texts: List[str], vectors) -> int:
+        """Add documents, replacing those whose id already exists; returns how many were new.
+
+        An id repeated within ``ids`` is added once, with its last text and vector.
+        """
+        vectors = normalize_rows(vectors)
+        if self.vectors is not None and vectors.shape[1] != self.vectors.shape[1]:
+            raise ValueError(f"dimension {vectors.shape[1]} does not match the collection's "
+                             f"{self.vectors.shape[1]}")
+        last = {d: i for i, d in enumerate(ids)}
+        batch = [(d, texts[i], vectors[i]) for d, i in last.items()]
+        new_rows = []
+        for d, t, v in batch:
+            row = self._rows.get(d)
+            if row is not None:
+                self.texts[row] = t
+                self.vectors[row] = v
+            else:
+                self._rows[d] = len(self.ids)
+                self.ids.append(d)
+                self.texts.append(t)
+                new_rows.append(v)
+        if new_rows:
+            added = np.stack(new_rows)
+            self.vectors = added if self.vectors is None else np.concatenate([self.vectors, added])
+        return len(new_rows)
+
+    def remove(self, ids: List[str]) -> int:
+        drop = {self._rows[d] for d in ids if d in self._rows}
+        if not drop:
+            return 0
+        keep = np.array([i not in drop for i in range(len(self.ids))], dtype=bool)
+        self.vectors = self.vectors[keep]
+        self.ids = [d for d, k in zip(self.ids, keep) if k]
+        self.texts = [t for t, k in zip(self.texts, keep) if k]
+        self._rows = {d: i for i, d in enumerate(self.ids)}
+        return len(drop)
+
+    def scores(self, qvec) -> np.ndarray:
+        """Cosine similarity of the query to every document, in row order."""
+        if self.vectors is None:
+            return np.zeros(0, dtype=np.float32)
+        return self.vectors @ normalize_rows(qvec).reshape(-1)
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        vectors = self.vectors if self.vectors is not None else np.zeros((0, 0), dtype=np.float32)
+
+        def write_docs(path):
+            with open(path, "w", encoding="utf-8") as f:
+                for d, t in zip(self.ids, self.texts):
+                    f.write(json.dumps({"id": d, "text": t}, ensure_ascii=False) + "\n")
+
+        def write_vectors(path):
+            with open(path, "wb") as f:
+                np.save(f, vectors)
+
+        def write_meta(path):
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"name": self.name, "model": self.model, "count": len(self.ids),
+                           "dim": int(vectors.shape[1])}, f)
+
+        _replace(os.path.join(directory, "docs.jsonl"), write_docs)
+        _replace(os.path.join(directory, "vectors.npy"), write_vectors)
+        _replace(os.path.join(directory, "meta.json"), write_meta)
+
+    @classmethod
+    def load(cls, directory: str) -> "DocumentCollection":
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(directory, "docs.jsonl"), "r", encoding="utf-8") as f:
+            docs = [json.loads(line) for line in f if line.strip()]
+        vectors = np.load(os.path.join(directory, "vectors.npy"))
+        if not (len(docs) == len(vectors) == meta["count"]):
+            raise RuntimeError(f"collection {meta['name']!r} is inconsistent on disk "
+                               f"({len(docs)} docs, {len(vectors)} vectors, {meta['count']} expected)")
+        return cls(meta["name"], meta["model"], [d["id"] for d in docs], [d["text"] for d in docs],
+                   vectors if len(vectors) else None)
+
+
+class CollectionStore:
+    """Collections by name, loaded from ``root`` on first access."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._loaded: Dict[str, DocumentCollection] = {}
+
+    def _dir(self, name: str) -> str:
+        if not NAME_RE.match(name):
+            raise ValueError(f"invalid collection name {name!r}")
+        return os.path.join(self.root, name)
+
+    def names(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(n for n in os.listdir(self.root)
+                      if NAME_RE.match(n) and os.path.exists(os.path.join(self.root, n, "meta.json")))
+
+    def get(self, name: str) -> Optional[DocumentCollection]:
+        coll = self._loaded.get(name)
+        if coll is None:
+            directory = self._dir(name)
+            if not os.path.exists(os.path.join(directory, "meta.json")):
+                return None
+            coll = self._loaded[name] = DocumentCollection.load(directory)
+        return coll
+
+    def create(self, name: str, model: str) -> DocumentCollection:
+        """A new empty collection, replacing any existing one of that name once saved."""
+        self._dir(name)
+        coll = self._loaded[name] = DocumentCollection(name, model)
+        return coll
+
+    def save(self, coll: DocumentCollection):
+        coll.save(self._dir(coll.name))
+
+    def drop(self, name: str) -> bool:
+        directory = self._dir(name)
+        self._loaded.pop(name, None)
+        if not os.path.isdir(directory):
+            return False
+        shutil.rmtree(directory)
+        return True
@@ -0,0 +1,121 @@
+"""Embedding backends for the similarity service.
+
+Every backend exposes ``async embed(texts) -> float32 matrix`` (one row per
+text, in order) and a ``model`` string that identifies its vectors, used as
+the embedding cache key:
+
+* OpenAIBackend: the embeddings API, in concurrent batched requests
+* LocalBackend: a sentence-transformers model on CPU (optionally its ONNX
+  export), run on a dedicated worker thread so the event loop stays free
+* HashBackend: hashed bag of words; no model, no network, for tests and
+  load testing
+"""
+import re
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import numpy as np
+
+
+class EmbeddingBackend:
+    model = "base"
+    # False when recomputing is cheaper than a cache lookup
+    cacheable = True
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    async def warmup(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+
+class OpenAIBackend(EmbeddingBackend):
+    def __init__(self, client, model: str = "text-embedding-3-small", batch_size: int = 256,
+                 concurrency: int = 4):
+        self.client = client
+        self.model = model
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """Identical texts are embedded once, unique texts are sent batch_size
+        per request, and at most ``concurrency`` requests run at the same time."""
+        unique = list(dict.fromkeys(texts))
+        batches = [unique[i:i + self.batch_size] for i in range(0, len(unique), self.batch_size)]
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def embed_batch(batch):
+            async with sem:
+                resp = await self.client.embeddings.create(model=self.model, input=batch)
+            # results carry the position of their input; don't rely on response order
+            return [np.asarray(d.embedding, dtype=np.float32) for d in sorted(resp.data, key=lambda d: d.index)]
+
+        results = await asyncio.gather(*(embed_batch(b) for b in batches))
+        vecs = np.stack([v for batch in results for v in batch])
+        row = {t: i for i, t in enumerate(unique)}
+        return vecs[[row[t] for t in texts]]
+
+
+class LocalBackend(EmbeddingBackend):
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", batch_size: int = 64, onnx: bool = False):
+        self.model_name = model_name
+        self.model = f"local:{model_name}" + (":onnx" if onnx else "")
+        self.batch_size = batch_size
+        self.onnx = onnx
+        self._model = None
+        # one thread owns the model: calls are serialized and batched there,
+        # while the model itself uses all cores for each batch
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+
+    def _load(self):
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            # backend="onnx" needs sentence-transformers>=3.2 with optimum/onnxruntime
+            kwargs = {"backend": "onnx"} if self.onnx else {}
+            self._model = SentenceTransformer(self.model_name, device="cpu", **kwargs)
+        return self._model
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        vecs = self._load().encode(texts, batch_size=self.batch_size, convert_to_numpy=True,
+                                   normalize_embeddings=True, show_progress_bar=False)
+        return np.asarray(vecs, dtype=np.float32)
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._encode, list(texts))
+
+    async def warmup(self):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._load)
+
+    async def aclose(self):
+        self._executor.shutdown(wait=False)
+
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+class HashBackend(EmbeddingBackend):
+    """Signed feature hashing of lower-cased words into ``dim`` buckets.
+
+    Texts sharing words get similar vectors, which is enough to exercise
+    ranking end to end without a model.
+    """
+    cacheable = False
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.model = f"hash-{dim}"
+
+    def _embed_one(self, text: str) -> np.ndarray:
+        v = np.zeros(self.dim, dtype=np.float32)
+        for tok in TOKEN_RE.findall(text.lower()):
+            h = int.from_bytes(hashlib.blake2b(tok.encode("utf-8"), digest_size=8).digest(), "little")
+            v[h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        return v
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        return np.stack([self._embed_one(t) for t in texts]) if texts else np.zeros((0, self.dim), np.float32)
@@ -0,0 +1,123 @@
+"""Content-addressed embedding cache: an in-memory LRU in front of SQLite.
+
+Entries are keyed by (model, sha256(text)) and stored as raw float32
+bytes, so a 1536-d vector takes 6 KB on disk and the text itself is never
+kept. When the table grows past ``max_rows`` the least recently used rows
+are deleted.
+"""
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    hash BLOB NOT NULL,
+    vec BLOB NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (model, hash)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);
+"""
+
+
+def text_hash(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str, max_rows: int = 100_000, memory_entries: int = 10_000):
+        self.path = path
+        self.max_rows = max_rows
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._rows = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _remember(self, key, vec):
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_memory(self, model: str, texts: List[str]) -> Dict[str, np.ndarray]:
+        """Like get_many, from the in-memory LRU only (no disk access)."""
+        found = {}
+        with self._lock:
+            for t in texts:
+                key = (model, text_hash(t))
+                vec = self._memory.get(key)
+                if vec is not None:
+                    self._memory.move_to_end(key)
+                    found[t] = vec
+            self.memory_hits += len(found)
+        return found
+
+    def get_many(self, model: str, texts: List[str]) -> Dict[str, np.ndarray]:
+        """Return the cached vectors for those of ``texts`` that have one."""
+        found = self.get_memory(model, texts)
+        missing = {text_hash(t): t for t in texts if t not in found}
+        with self._lock:
+            if missing:
+                hashes = list(missing)
+                rows = []
+                # stay under SQLite's bound-parameter limit
+                for i in range(0, len(hashes), 500):
+                    chunk = hashes[i:i + 500]
+                    marks = ",".join("?" * len(chunk))
+                    rows += self._db.execute(
+                        f"SELECT hash, vec FROM embeddings WHERE model = ? AND hash IN ({marks})",
+                        [model, *chunk]).fetchall()
+                for h, blob in rows:
+                    vec = np.frombuffer(blob, dtype=np.float32)
+                    found[missing[h]] = vec
+                    self._remember((model, h), vec)
+                if rows:
+                    self._db.executemany("UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                                         [(time.time(), model, h) for h, _ in rows])
+                    self._db.commit()
+                self.disk_hits += len(rows)
+                self.misses += len(missing) - len(rows)
+        return found
+
+    def put_many(self, model: str, texts: List[str], vecs: np.ndarray):
+        now = time.time()
+        vecs = np.asarray(vecs, dtype=np.float32)
+        with self._lock:
+            rows = []
+            for t, v in zip(texts, vecs):
+                h = text_hash(t)
+                self._remember((model, h), v)
+                rows.append((model, h, v.tobytes(), now))
+            before = self._db.total_changes
+            self._db.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._rows += self._db.total_changes - before
+            if self._rows > self.max_rows:
+                # trim to 90% so eviction doesn't run on every insert
+                excess = self._rows - int(self.max_rows * 0.9)
+                self._db.execute("DELETE FROM embeddings WHERE (model, hash) IN (SELECT model, hash "
+                                 "FROM embeddings ORDER BY last_used LIMIT ?)", (excess,))
+                self._rows = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            self._db.commit()
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {"memory_hits": self.memory_hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "rows": self._rows, "memory_entries": len(self._memory)}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
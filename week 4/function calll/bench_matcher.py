@@ -0,0 +1,70 @@
+"""Per-query cost of intent matching against catalog size.
+
+    python bench_matcher.py [--sizes 5 50 500 2000] [--queries 5000]
+
+Builds synthetic catalogs shaped like the app's patterns (a literal phrase
+followed by captured arguments), then times the sequential regex loop
+against IntentMatcher on the same query mix (80% matching, 20% not) and
+checks both return the same results.
+"""
+import re
+import time
+import random
+import argparse
+
+from intent_matcher import IntentMatcher, match_sequential
+
+WORDS = ["ticket", "meeting", "expense", "bonus", "issue", "laptop", "badge", "parking", "payroll",
+         "vpn", "printer", "travel", "invoice", "training", "access", "license", "desk", "visitor"]
+VERBS = ["status of", "request", "cancel", "renew", "report", "approve", "check", "update"]
+
+
+def synthetic_catalog(n, rng):
+    catalog, phrases = [], set()
+    while len(catalog) < n:
+        phrase = f"{rng.choice(VERBS)} {rng.choice(WORDS)} {rng.choice(WORDS)}{len(catalog)}"
+        if phrase in phrases:
+            continue
+        phrases.add(phrase)
+        catalog.append({
+            "name": f"intent_{len(catalog)}",
+            "keywords": [phrase],
+            "regex": re.compile(re.escape(phrase) + r"\s+(?P<id>\d+)", re.IGNORECASE),
+            "extract": lambda m: {"id": int(m.group('id'))},
+        })
+    return catalog, sorted(phrases)
+
+
+def synthetic_queries(phrases, n, rng):
+    queries = []
+    for _ in range(n):
+        if rng.random() < 0.8:
+            queries.append(f"Please {rng.choice(phrases)} {rng.randint(1, 99999)} today.")
+        else:
+            queries.append(f"Could you {rng.choice(VERBS)} my {rng.choice(WORDS)} situation?")
+    return queries
+
+
+def per_query_us(fn, queries):
+    t0 = time.perf_counter()
+    for q in queries:
+        fn(q)
+    return (time.perf_counter() - t0) / len(queries) * 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5, 50, 500, 2000])
+    parser.add_argument("--queries", type=int, default=5000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"{'intents':>8} {'sequential us':>14} {'compiled us':>12} {'speedup':>8}")
+    for n in args.sizes:
+        catalog, phrases = synthetic_catalog(n, rng)
+        queries = synthetic_queries(phrases, args.queries, rng)
+        matcher = IntentMatcher(catalog)
+        assert all(matcher.match(q) == match_sequential(catalog, q) for q in queries)
+        seq = per_query_us(lambda q: match_sequential(catalog, q), queries)
+        comp = per_query_us(matcher.match, queries)
+        print(f"{n:>8} {seq:>14.2f} {comp:>12.2f} {seq / comp:>7.1f}x")
@@ -0,0 +1,77 @@
+"""Client-side overhead of one function-calling request, without the network.
+
+    python bench_payload.py [--calls 2000]
+
+Both paths talk to an in-process transport that returns a canned tool-call
+response, so the numbers are the cost of building the request and parsing
+the response:
+
+* sdk: openai.AsyncOpenAI chat.completions.create(tools=...) followed by
+  to_dict() normalization, as the app did before
+* precomputed: the app's pre-serialized body and parse_tool_call
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+
+import httpx
+
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+import app  # noqa: E402
+
+CANNED = {
+    "id": "chatcmpl-bench", "object": "chat.completion", "created": 0, "model": app.CHAT_MODEL,
+    "choices": [{"index": 0, "finish_reason": "tool_calls", "message": {
+        "role": "assistant", "content": None,
+        "tool_calls": [{"id": "call_0", "type": "function", "function": {
+            "name": "get_ticket_status", "arguments": "{\"ticket_id\": 83742}"}}]}}],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+}
+CANNED_BYTES = json.dumps(CANNED).encode("utf-8")
+
+
+def transport():
+    return httpx.MockTransport(lambda request: httpx.Response(
+        200, content=CANNED_BYTES, headers={"content-type": "application/json"}))
+
+
+async def sdk_call(client, query):
+    response = await client.chat.completions.create(
+        model=app.CHAT_MODEL, messages=[{"role": "user", "content": query}],
+        tools=app.TOOLS, tool_choice="auto")
+    data = response.to_dict()
+    return app.parse_tool_call(data, query)
+
+
+async def timed(fn, calls):
+    await fn("warmup")
+    t0 = time.perf_counter()
+    for i in range(calls):
+        await fn(f"What is the status of ticket {i}?")
+    return (time.perf_counter() - t0) / calls * 1e6
+
+
+async def main(calls):
+    import openai
+    sdk = openai.AsyncOpenAI(api_key="bench", base_url="http://bench/v1",
+                             http_client=httpx.AsyncClient(transport=transport()))
+    app._http_client = httpx.AsyncClient(transport=transport())
+    app.OPENAI_BASE_URL = "http://bench/v1"
+
+    sdk_us = await timed(lambda q: sdk_call(sdk, q), calls)
+    pre_us = await timed(app.call_openai_for_function_call, calls)
+    t0 = time.perf_counter()
+    for i in range(calls):
+        app.build_request_body(f"What is the status of ticket {i}?")
+    body_us = (time.perf_counter() - t0) / calls * 1e6
+    print(f"{'sdk':>12}: {sdk_us:8.1f} us/call")
+    print(f"{'precomputed':>12}: {pre_us:8.1f} us/call  ({sdk_us / pre_us:.1f}x less overhead)")
+    print(f"{'body only':>12}: {body_us:8.2f} us/call  ({len(app.build_request_body('x'))} bytes)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=2000)
+    asyncio.run(main(parser.parse_args().calls))
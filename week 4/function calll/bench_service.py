@@ -0,0 +1,232 @@
+"""Load test and latency benchmark for the function-calling service.
+
+    python bench_service.py [--queries 2000] [--concurrency 1 16 64]
+                            [--llm-latency-ms 300] [--llm-jitter-ms 100]
+                            [--url http://localhost:8000] [--out report.json]
+                            [--baseline old.json] [--max-regression 0.2]
+
+A synthetic query mix is generated from the app's templates: templated
+queries that match a pattern, free-form questions that contain a matching
+phrase (low confidence, so /execute_ai asks the model), and queries that
+match nothing. A mock chat-completions server with injected latency stands
+in for the model (OPENAI_BASE_URL is pointed at it), and the app is driven
+in-process through its ASGI interface, so no network or API key is needed.
+--url additionally load-tests a running server over HTTP (start it with
+OPENAI_BASE_URL set to the mock's address to keep it offline).
+
+Scenarios: /execute, /execute_ai with default routing, /execute_ai forced to
+the model (local_first=false, no budget), and /execute/batch in batches of
+100. Each reports throughput, latency percentiles and which route answered.
+Reports are JSON; with --baseline every metric is compared against an
+earlier report, and latency/throughput changes worse than --max-regression
+are listed under "regressions" (and make the exit status 1).
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import numpy as np
+
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+import app  # noqa: E402
+from route_cache import TTLCache  # noqa: E402
+
+TEMPLATES = [
+    lambda r: f"What is the status of ticket {r.randint(10000, 99999)}?",
+    lambda r: f"Schedule a meeting on 2025-{r.randint(1, 12):02d}-{r.randint(1, 28):02d} at "
+              f"{r.randint(8, 18)}:{r.choice(['00', '30'])} in Room {r.choice('ABCDE')}.",
+    lambda r: f"Show my expense balance for employee {r.randint(10000, 99999)}.",
+    lambda r: f"Calculate performance bonus for employee {r.randint(10000, 99999)} for {r.randint(2020, 2026)}.",
+    lambda r: f"Report office issue {r.randint(10000, 99999)} for the "
+              f"{r.choice(['Facilities', 'IT', 'HR', 'Finance'])} department.",
+]
+FREE_FORM = [
+    "Sorry to chase, I raised something last week and I still want the status of ticket {n} please",
+    "My manager asked me to check, could you look up the expense balance for employee {n} when free",
+]
+UNMATCHED = ["How do I reset my VPN password?", "Who is on call this weekend?",
+             "Can I get a second monitor?", "Where is the nearest printer?", "What is the wifi password?"]
+
+
+def generate_queries(n, seed=0, matching=0.7, free_form=0.15):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n):
+        x = rng.random()
+        if x < matching:
+            queries.append(rng.choice(TEMPLATES)(rng))
+        elif x < matching + free_form:
+            queries.append(rng.choice(FREE_FORM).format(n=rng.randint(10000, 99999)))
+        else:
+            queries.append(rng.choice(UNMATCHED))
+    return queries
+
+
+def percentiles(samples_ms):
+    a = np.asarray(samples_ms, dtype=np.float64)
+    if a.size == 0:
+        return {}
+    return {"mean": float(a.mean()), "p50": float(np.percentile(a, 50)),
+            "p95": float(np.percentile(a, 95)), "p99": float(np.percentile(a, 99))}
+
+
+def start_mock_llm(latency_ms, jitter_ms, seed=0):
+    """Chat-completions stand-in: sleeps, then answers with the local matcher's tool call."""
+    rng = random.Random(seed)
+    lock = threading.Lock()
+    calls = [0]
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            with lock:
+                calls[0] += 1
+                delay = max(0.0, rng.gauss(latency_ms, jitter_ms)) / 1000.0
+            time.sleep(delay)
+            match = app.matcher.match(body["messages"][0]["content"])
+            message = {"role": "assistant", "content": "I can't help with that."}
+            if match is not None:
+                message = {"role": "assistant", "content": None, "tool_calls": [
+                    {"id": "call_0", "type": "function", "function": match}]}
+            payload = json.dumps({"object": "chat.completion", "choices": [
+                {"index": 0, "message": message, "finish_reason": "stop"}]}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, calls
+
+
+async def run_load(client, requests, concurrency):
+    """requests: list of (method, path, params or json). Returns the scenario report."""
+    latencies, sources, errors = [], Counter(), 0
+    queue = iter(requests)
+
+    async def worker():
+        nonlocal errors
+        for method, path, payload in queue:
+            t0 = time.perf_counter()
+            if method == "GET":
+                r = await client.get(path, params=payload)
+            else:
+                r = await client.post(path, json=payload)
+            latencies.append((time.perf_counter() - t0) * 1e3)
+            if r.status_code != 200:
+                errors += 1
+            elif "X-Route-Source" in r.headers:
+                sources[r.headers["X-Route-Source"]] += 1
+            elif path.endswith("/batch"):
+                sources.update(x["source"] for x in r.json()["results"])
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    return {"concurrency": concurrency, "requests": len(requests), "errors": errors,
+            "rps": len(requests) / elapsed, "latency_ms": percentiles(latencies), "routes": dict(sources)}
+
+
+def scenarios(queries):
+    return {
+        "execute": [("GET", "/execute", {"q": q}) for q in queries],
+        "execute_ai": [("GET", "/execute_ai", {"q": q}) for q in queries],
+        "execute_ai_model": [("GET", "/execute_ai", {"q": q, "local_first": "false", "budget_ms": 0})
+                             for q in queries],
+        "execute_batch": [("POST", "/execute/batch", {"queries": queries[i:i + 100]})
+                          for i in range(0, len(queries), 100)],
+    }
+
+
+async def measure(base_url, transport, queries, concurrency_levels):
+    report = {}
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=60) as client:
+        for name, requests in scenarios(queries).items():
+            report[name] = {}
+            for c in concurrency_levels:
+                # every run starts cold so results don't depend on scenario order
+                app.route_cache = TTLCache(app.ROUTE_CACHE_SIZE, app.ROUTE_CACHE_TTL)
+                report[name][f"c{c}"] = await run_load(client, requests, c)
+    return report
+
+
+# metric name -> True when higher is better
+TRACKED = {"rps": True, "mean": False, "p50": False, "p95": False, "p99": False}
+
+
+def compare(report, baseline, max_regression, prefix="", found=None):
+    """Print every numeric change and return the ones worse than max_regression."""
+    found = [] if found is None else found
+    for key, value in report.items():
+        old = baseline.get(key) if isinstance(baseline, dict) else None
+        if isinstance(value, dict):
+            compare(value, old or {}, max_regression, prefix + key + ".", found)
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            change = (value - old) / old
+            print(f"{prefix + key:<55} {old:12.3f} -> {value:12.3f}  ({change * 100:+.1f}%)")
+            if key in TRACKED and (-change if TRACKED[key] else change) > max_regression:
+                found.append({"metric": prefix + key, "baseline": old, "current": value,
+                              "change": change})
+    return found
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--llm-jitter-ms", type=float, default=100)
+    parser.add_argument("--url", help="also load-test a running server, e.g. http://localhost:8000")
+    parser.add_argument("--out", default="function_call_benchmark.json")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="relative change counted as a regression (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    server, llm_calls = start_mock_llm(args.llm_latency_ms, args.llm_jitter_ms, args.seed)
+    app.OPENAI_BASE_URL = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    print(f"mock LLM at {app.OPENAI_BASE_URL}")
+    queries = generate_queries(args.queries, args.seed)
+
+    report = {"config": {"queries": len(queries), "concurrency": args.concurrency,
+                         "llm_latency_ms": args.llm_latency_ms, "llm_jitter_ms": args.llm_jitter_ms,
+                         "budget_ms": app.BUDGET_MS, "max_llm_concurrency": app.MAX_CONCURRENCY,
+                         "local_min_confidence": app.LOCAL_MIN_CONFIDENCE,
+                         "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")}}
+
+    async def main():
+        report["in_process"] = await measure("http://app", httpx.ASGITransport(app=app.app),
+                                             queries, args.concurrency)
+        if args.url:
+            report["http"] = await measure(args.url, None, queries, args.concurrency)
+        await app.get_http_client().aclose()
+
+    asyncio.run(main())
+    report["mock_llm_calls"] = llm_calls[0]
+    server.shutdown()
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            report["regressions"] = compare(report, json.load(f), args.max_regression)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    if report.get("regressions"):
+        sys.exit(1)
@@ -0,0 +1,75 @@
+"""Compiled dispatch over the regex intent catalog.
+
+Each pattern may list ``keywords``: lower-case words or phrases that appear
+literally, as whole words, in every query it matches. At build time every
+pattern is indexed under the rarest word of its keywords; at query time the
+query's words are looked up in that index (one dict lookup per word,
+independent of catalog size), candidates whose keywords are not all present
+are dropped, and only the remaining full regexes run, in catalog order so
+the first match still wins. Patterns without keywords are always tried.
+"""
+import re
+import json
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+WORD_RE = re.compile(r"\w+")
+
+
+class IntentMatcher:
+    def __init__(self, patterns: List[Dict[str, Any]]):
+        self.patterns = patterns
+        self._always = []
+        self._keywords = []
+        keyed = []
+        for i, p in enumerate(patterns):
+            keywords = [kw.lower() for kw in p.get("keywords") or []]
+            self._keywords.append(keywords)
+            if keywords:
+                keyed.append(i)
+            else:
+                self._always.append(i)
+        df = Counter(w for i in keyed for w in {w for kw in self._keywords[i] for w in WORD_RE.findall(kw)})
+        self._index: Dict[str, List[int]] = {}
+        for i in keyed:
+            words = {w for kw in self._keywords[i] for w in WORD_RE.findall(kw)}
+            anchor = min(words, key=lambda w: (df[w], w))
+            self._index.setdefault(anchor, []).append(i)
+
+    def candidates(self, text: str) -> List[int]:
+        """Indices of the patterns that could match ``text``, in catalog order."""
+        lowered = text.lower()
+        found = list(self._always)
+        for w in set(WORD_RE.findall(lowered)):
+            for i in self._index.get(w, ()):
+                if all(kw in lowered for kw in self._keywords[i]):
+                    found.append(i)
+        return sorted(found)
+
+    def match(self, text: str) -> Optional[Dict[str, str]]:
+        """{"name", "arguments"} for the first pattern matching ``text``, or None."""
+        scored = self.match_scored(text)
+        return scored[0] if scored is not None else None
+
+    def match_scored(self, text: str) -> Optional[Tuple[Dict[str, str], float]]:
+        """Like match, also returning a confidence in (0, 1]: the share of the
+        query's words covered by the regex match. A templated query
+        scores high; a long free-form question that merely contains a
+        matching phrase scores low."""
+        for i in self.candidates(text):
+            p = self.patterns[i]
+            m = p['regex'].search(text)
+            if m:
+                covered = len(WORD_RE.findall(m.group(0)))
+                total = len(WORD_RE.findall(text))
+                return {"name": p['name'], "arguments": json.dumps(p['extract'](m))}, covered / max(total, 1)
+        return None
+
+
+def match_sequential(patterns: List[Dict[str, Any]], text: str) -> Optional[Dict[str, str]]:
+    """Reference implementation: every regex in order (what IntentMatcher replaces)."""
+    for p in patterns:
+        m = p['regex'].search(text)
+        if m:
+            return {"name": p['name'], "arguments": json.dumps(p['extract'](m))}
+    return None
@@ -0,0 +1,56 @@
+"""Bounded TTL cache for LLM-routed function calls.
+
+Keys are normalized queries (case, whitespace and trailing punctuation
+folded), so trivially different phrasings of the same templated question
+share one entry. Expired entries are dropped on access; when full, the
+least recently used entry is evicted.
+"""
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    return _SPACE_RE.sub(" ", text.strip().lower()).rstrip(" .?!")
+
+
+class TTLCache:
+    def __init__(self, max_entries: int = 10_000, ttl: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"entries": len(self._data), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0}
@@ -43,3 +43,207 @@ def test_report_office_issue():
     assert res['name'] == 'report_office_issue'
     args = json.loads(res['arguments'])
     assert args == {'issue_code': 45321, 'department': 'Facilities'}
+
+
+def test_matcher_agrees_with_sequential_scan():
+    import re
+    from app import patterns
+    from intent_matcher import IntentMatcher, match_sequential
+
+    catalog = patterns + [
+        # no keywords: always a candidate
+        {"name": "ping", "regex": re.compile(r"^ping$", re.IGNORECASE), "extract": lambda m: {}},
+        # keyword shares its rarest word with another intent's keyword
+        {"name": "ticket_owner", "keywords": ["owner of ticket"],
+         "regex": re.compile(r"owner of ticket\s+(?P<t>\d+)", re.IGNORECASE),
+         "extract": lambda m: {"ticket_id": int(m.group('t'))}},
+    ]
+    matcher = IntentMatcher(catalog)
+    queries = ['What is the status of ticket 83742?', 'Who is the OWNER of ticket 12?', 'ping',
+               'Schedule a meeting on 2025-02-15 at 14:00 in Room A.', 'status of tickets 5',
+               'Report office issue 45321 for the Facilities department.', 'hello there']
+    for q in queries:
+        assert matcher.match(q) == match_sequential(catalog, q)
+    assert matcher.match('Who is the owner of ticket 12?')['name'] == 'ticket_owner'
+    assert matcher.match('ping')['name'] == 'ping'
+
+
+def test_execute_ai_local_first_and_cache(monkeypatch):
+    import app as app_module
+    from route_cache import TTLCache
+
+    calls = []
+
+    async def fake_llm(query, required=False):
+        calls.append(query)
+        return {'name': 'get_ticket_status', 'arguments': json.dumps({'ticket_id': 7})}
+
+    monkeypatch.setattr(app_module, 'call_openai_for_function_call', fake_llm)
+    monkeypatch.setattr(app_module, 'route_cache', TTLCache())
+
+    r = client.get('/execute_ai', params={'q': 'What is the status of ticket 83742?'})
+    assert r.headers['X-Route-Source'] == 'local' and calls == []
+    assert json.loads(r.json()['arguments']) == {'ticket_id': 83742}
+
+    q = 'hey, the thing I filed yesterday about my laptop, ticket seven, where is it at'
+    assert client.get('/execute_ai', params={'q': q}).headers['X-Route-Source'] == 'llm'
+    r = client.get('/execute_ai', params={'q': '  HEY, the thing I filed yesterday about my laptop, ticket seven, where is it at?'})
+    assert r.headers['X-Route-Source'] == 'cache' and len(calls) == 1
+    assert r.json()['name'] == 'get_ticket_status'
+
+    r = client.get('/execute_ai', params={'q': 'What is the status of ticket 83742?', 'local_first': 'false'})
+    assert r.headers['X-Route-Source'] == 'llm' and len(calls) == 2
+
+
+def test_execute_ai_hedges_to_local_match_when_model_is_slow(monkeypatch):
+    import time
+    import asyncio
+    import app as app_module
+    from route_cache import TTLCache
+
+    async def slow_llm(query, required=False):
+        await asyncio.sleep(0.3)
+        return {'name': 'get_ticket_status', 'arguments': json.dumps({'ticket_id': 5, 'from': 'llm'})}
+
+    monkeypatch.setattr(app_module, 'call_openai_for_function_call', slow_llm)
+    monkeypatch.setattr(app_module, 'route_cache', TTLCache())
+    monkeypatch.setattr(app_module, '_llm_slots', None)
+    # low confidence: the match covers a small part of the query, so the model is asked
+    q = 'Sorry to bother you again, I am still waiting on the status of ticket 5 since last week'
+    with TestClient(app) as c:
+        t0 = time.perf_counter()
+        r = c.get('/execute_ai', params={'q': q, 'budget_ms': 50})
+        assert time.perf_counter() - t0 < 0.25
+        assert r.headers['X-Route-Source'] == 'hedge'
+        assert json.loads(r.json()['arguments']) == {'ticket_id': 5}
+        # the model call finished in the background and filled the cache
+        time.sleep(0.4)
+        r = c.get('/execute_ai', params={'q': q})
+        assert r.headers['X-Route-Source'] == 'cache'
+        assert json.loads(r.json()['arguments'])['from'] == 'llm'
+
+
+def test_model_calls_respect_concurrency_limit(monkeypatch):
+    import asyncio
+    import app as app_module
+
+    in_flight, peak = [0], [0]
+
+    async def fake_llm(query, required=False):
+        in_flight[0] += 1
+        peak[0] = max(peak[0], in_flight[0])
+        await asyncio.sleep(0.01)
+        in_flight[0] -= 1
+        return {'name': 'none', 'arguments': '{}'}
+
+    monkeypatch.setattr(app_module, 'call_openai_for_function_call', fake_llm)
+
+    async def run():
+        monkeypatch.setattr(app_module, '_llm_slots', asyncio.Semaphore(2))
+        await asyncio.gather(*(app_module._call_model(f'q{i}', False, ('q', i)) for i in range(8)))
+
+    asyncio.run(run())
+    assert peak[0] == 2
+
+
+def test_execute_batch(monkeypatch):
+    import app as app_module
+    from route_cache import TTLCache
+
+    calls = []
+
+    async def fake_llm(query, required=False):
+        calls.append(query)
+        if 'explode' in query:
+            raise RuntimeError('upstream error')
+        return {'name': 'none', 'arguments': json.dumps({'query': query})}
+
+    monkeypatch.setattr(app_module, 'call_openai_for_function_call', fake_llm)
+    monkeypatch.setattr(app_module, 'route_cache', TTLCache())
+    monkeypatch.setattr(app_module, '_llm_slots', None)
+    queries = ['What is the status of ticket 83742?', 'tell me a joke', 'Tell me a joke.',
+               'Show my expense balance for employee 10056.', 'please explode']
+    r = client.post('/execute/batch', json={'queries': queries})
+    assert r.status_code == 200
+    results = r.json()['results']
+    assert [x['source'] for x in results] == ['local', 'llm', 'llm', 'local', 'fallback']
+    assert results[0]['name'] == 'get_ticket_status'
+    assert json.loads(results[3]['arguments']) == {'employee_id': 10056}
+    # the two jokes normalize to one model call
+    assert sorted(calls) == ['please explode', 'tell me a joke']
+
+    r = client.post('/execute/batch', json={'queries': ['tell me a joke', 'hello'], 'ai': False})
+    assert [x['source'] for x in r.json()['results']] == ['none', 'none']
+
+
+def test_openai_call_uses_precomputed_tools_payload(monkeypatch):
+    import asyncio
+    import httpx
+    import app as app_module
+
+    sent = []
+
+    def handler(request):
+        body = json.loads(request.content)
+        sent.append(body)
+        if body['messages'][0]['content'] == 'fail':
+            return httpx.Response(500, text='boom')
+        message = {'role': 'assistant', 'content': None, 'tool_calls': [{'id': 'c', 'type': 'function',
+                   'function': {'name': 'get_expense_balance', 'arguments': '{"employee_id": 1}'}}]}
+        if body['tool_choice'] == 'auto':
+            message = {'role': 'assistant', 'content': 'no tool'}
+        return httpx.Response(200, json={'choices': [{'index': 0, 'message': message}]})
+
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    monkeypatch.setattr(app_module, '_http_client', httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    async def run():
+        required = await app_module.call_openai_for_function_call('balance "quoted"', required=True)
+        optional = await app_module.call_openai_for_function_call('hello')
+        try:
+            await app_module.call_openai_for_function_call('fail')
+        except RuntimeError as e:
+            return required, optional, str(e)
+
+    required, optional, error = asyncio.run(run())
+    assert required == {'name': 'get_expense_balance', 'arguments': '{"employee_id": 1}'}
+    assert optional == {'name': 'none', 'arguments': json.dumps({'query': 'hello'})}
+    assert '500' in error
+    assert sent[0]['tools'] == app_module.TOOLS and sent[0]['tool_choice'] == 'required'
+    assert sent[0]['messages'] == [{'role': 'user', 'content': 'balance "quoted"'}]
+
+
+def test_tools_payload_sends_only_schema_fields():
+    import app as app_module
+
+    body = json.loads(app_module.build_request_body('What is the status of ticket 1?'))
+    assert {t['type'] for t in body['tools']} == {'function'}
+    for tool in body['tools']:
+        assert set(tool) == {'type', 'function'}
+        assert set(tool['function']) == {'name', 'description', 'parameters'}
+
+
+def test_execute_ai_falls_back_on_malformed_model_response(monkeypatch):
+    import httpx
+    import app as app_module
+
+    bodies = {
+        'not json': b'<html>bad gateway</html>',
+        'no message': json.dumps({'choices': [{'index': 0}]}).encode(),
+        'no function': json.dumps({'choices': [{'message': {'tool_calls': [{'id': 'c'}]}}]}).encode(),
+        'not a dict': json.dumps(['choices']).encode(),
+    }
+
+    def handler(request):
+        kind = json.loads(request.content)['messages'][0]['content'].split(': ')[0]
+        return httpx.Response(200, content=bodies[kind], headers={'content-type': 'application/json'})
+
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    monkeypatch.setattr(app_module, '_http_client', httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(app_module, 'route_cache', app_module.TTLCache(100, 60))
+    for kind in bodies:
+        r = client.get('/execute_ai', params={'q': f'{kind}: what is the status of ticket 7?',
+                                              'local_first': 'false', 'budget_ms': 0})
+        assert r.status_code == 200
+        assert r.headers['X-Route-Source'] == 'fallback'
+        assert r.json() == {'name': 'get_ticket_status', 'arguments': json.dumps({'ticket_id': 7})}
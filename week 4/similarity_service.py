@@ -1,8 +1,12 @@
-from typing import List, Optional
-from fastapi import FastAPI, HTTPException
+import asyncio
+import importlib.util
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+from fastapi import FastAPI, HTTPException, Query
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 import openai
+import httpx
 import dotenv
 
 import os
@@ -18,17 +22,97 @@ except Exception:
 
 import numpy as np
 
+from embedding_cache import EmbeddingCache
+from embedding_backends import EmbeddingBackend, OpenAIBackend, LocalBackend, HashBackend
+from doc_collections import CollectionStore, doc_id, normalize_rows
+
+# "openai" (default), "local" (sentence-transformers on CPU, no network) or
+# "hash" (no model at all; what SIM_TEST_MODE=1 falls back to without a key)
+EMBED_BACKEND = os.environ.get("SIM_EMBED_BACKEND", "openai")
+LOCAL_MODEL = os.environ.get("SIM_LOCAL_MODEL", "all-MiniLM-L6-v2")
+LOCAL_BATCH_SIZE = int(os.environ.get("SIM_LOCAL_BATCH_SIZE", "64"))
+LOCAL_ONNX = os.environ.get("SIM_LOCAL_ONNX") == "1"
+EMBED_MODEL = os.environ.get("SIM_EMBED_MODEL", "text-embedding-3-small")
+# texts per embeddings request (the API accepts up to 2048 inputs)
+EMBED_BATCH_SIZE = int(os.environ.get("SIM_EMBED_BATCH_SIZE", "256"))
+# embeddings requests in flight at once for a single call
+EMBED_CONCURRENCY = int(os.environ.get("SIM_EMBED_CONCURRENCY", "4"))
+# SQLite file for cached embeddings; set SIM_CACHE_PATH="" to disable caching
+CACHE_PATH = os.environ.get("SIM_CACHE_PATH", "embedding_cache.sqlite3")
+CACHE_MAX_ROWS = int(os.environ.get("SIM_CACHE_MAX_ROWS", "100000"))
+CACHE_MEMORY_ENTRIES = int(os.environ.get("SIM_CACHE_MEMORY_ENTRIES", "10000"))
+DEFAULT_TOP_K = 3
+# where named document collections are persisted
+COLLECTIONS_DIR = os.environ.get("SIM_COLLECTIONS_DIR", "collections")
+# the OpenAI client and its connection pool live as long as the app; the
+# OPENAI_HTTP_* variables are shared with the function-calling service
+HTTP_MAX_CONNECTIONS = int(os.environ.get("OPENAI_HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("OPENAI_HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_TIMEOUT = float(os.environ.get("OPENAI_HTTP_TIMEOUT", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("OPENAI_HTTP_CONNECT_TIMEOUT", "5"))
+
 
 class SimilarityRequest(BaseModel):
     docs: List[str]
     query: str
+    top_k: int = DEFAULT_TOP_K
 
 
 class SimilarityResponse(BaseModel):
     matches: List[str]
 
 
-app = FastAPI()
+class CollectionDocs(BaseModel):
+    docs: List[str]
+    # defaults to a hash of each text, so re-adding a document replaces it
+    ids: Optional[List[str]] = None
+
+
+class CollectionQuery(BaseModel):
+    query: str
+    top_k: int = DEFAULT_TOP_K
+
+
+class CollectionMatch(BaseModel):
+    id: str
+    text: str
+    score: float
+
+
+class CollectionQueryResponse(BaseModel):
+    matches: List[CollectionMatch]
+
+
+_client = None
+_cache = None
+_backend = None
+_collections = None
+_collection_locks: Dict[str, asyncio.Lock] = {}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # open the pooled client / load the local model up front so the first
+    # request doesn't pay for it
+    global _client, _cache, _backend
+    if EMBED_BACKEND == "openai" and os.environ.get("OPENAI_API_KEY"):
+        get_client()
+    elif EMBED_BACKEND != "openai":
+        await get_backend().warmup()
+    yield
+    if _backend is not None:
+        await _backend.aclose()
+        _backend = None
+    if _client is not None:
+        await _client.close()
+        _client = None
+    if _cache is not None:
+        _cache.close()
+        _cache = None
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow all origins for simplicity in internal app — restrict in production
 app.add_middleware(
@@ -39,7 +123,29 @@ app.add_middleware(
 )
 
 
+def get_cache() -> Optional[EmbeddingCache]:
+    global _cache
+    if _cache is None and CACHE_PATH:
+        _cache = EmbeddingCache(CACHE_PATH, max_rows=CACHE_MAX_ROWS, memory_entries=CACHE_MEMORY_ENTRIES)
+    return _cache
+
+
+def make_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        # httpx only speaks HTTP/2 with the optional h2 package installed
+        http2=importlib.util.find_spec("h2") is not None,
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY),
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    )
+
+
 def get_client():
+    """The app-wide async OpenAI client, created on first use."""
+    global _client
+    if _client is not None:
+        return _client
     # Prefer explicit API key via env var OPENAI_API_KEY
     api_key = os.environ.get("OPENAI_API_KEY")
     if not api_key:
@@ -47,65 +153,90 @@ def get_client():
         if os.environ.get("SIM_TEST_MODE") == "1":
             return None
         raise RuntimeError("OPENAI_API_KEY environment variable is required")
-    # The new split library uses client object
-    try:
-        return openai.OpenAI(api_key=api_key, base_url=os.environ.get("OPENAI_BASE_URL"))
-    except Exception:
-        # older openai lib
-        openai.api_key = api_key
-        return openai
-
+    # async client, so batches of one request can be embedded concurrently;
+    # reused by every request so connections and TLS sessions are kept alive
+    _client = openai.AsyncOpenAI(api_key=api_key, base_url=os.environ.get("OPENAI_BASE_URL"),
+                                 http_client=make_http_client())
+    return _client
 
-def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
-    if a.ndim != 1 or b.ndim != 1:
-        raise ValueError("cosine_similarity expects 1-D vectors")
-    denom = (np.linalg.norm(a) * np.linalg.norm(b))
-    if denom == 0:
-        return 0.0
-    return float(np.dot(a, b) / denom)
 
-
-def _compute_top_matches(docs: List[str], query: str, top_k: int = 3) -> SimilarityResponse:
+def get_backend() -> EmbeddingBackend:
+    global _backend
+    if EMBED_BACKEND == "openai":
+        client = get_client()
+        if client is None:
+            # SIM_TEST_MODE without credentials
+            return HashBackend()
+        return OpenAIBackend(client, EMBED_MODEL, EMBED_BATCH_SIZE, EMBED_CONCURRENCY)
+    if _backend is None:
+        if EMBED_BACKEND == "local":
+            _backend = LocalBackend(LOCAL_MODEL, batch_size=LOCAL_BATCH_SIZE, onnx=LOCAL_ONNX)
+        elif EMBED_BACKEND == "hash":
+            _backend = HashBackend()
+        else:
+            raise RuntimeError(f"Unknown SIM_EMBED_BACKEND {EMBED_BACKEND!r}, expected openai, local or hash")
+    return _backend
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, ties in input order."""
+    k = min(k, len(scores))
+    if k < len(scores):
+        part = np.argpartition(-scores, k - 1)[:k]
+    else:
+        part = np.arange(len(scores))
+    return part[np.lexsort((part, -scores[part]))]
+
+
+def top_k_cosine(qemb: np.ndarray, doc_matrix: np.ndarray, k: int) -> np.ndarray:
+    """Rank the rows of doc_matrix by cosine similarity to qemb with one matrix-vector product."""
+    sims = normalize_rows(doc_matrix) @ normalize_rows(qemb)
+    return top_k_indices(sims, k)
+
+
+async def cached_embed(backend: EmbeddingBackend, texts: List[str],
+                       cache: Optional[EmbeddingCache] = None) -> np.ndarray:
+    """backend.embed, serving texts seen before from the embedding cache.
+
+    The in-memory LRU is checked inline; SQLite lookups and writes run in a
+    worker thread so they don't block the event loop.
+    """
+    if cache is None:
+        return await backend.embed(texts)
+    unique = list(dict.fromkeys(texts))
+    found = cache.get_memory(backend.model, unique)
+    rest = [t for t in unique if t not in found]
+    if rest:
+        found.update(await asyncio.to_thread(cache.get_many, backend.model, rest))
+    todo = [t for t in unique if t not in found]
+    if todo:
+        vecs = await backend.embed(todo)
+        await asyncio.to_thread(cache.put_many, backend.model, todo, vecs)
+        found.update(zip(todo, vecs))
+    return np.stack([found[t] for t in texts])
+
+
+async def _compute_top_matches(docs: List[str], query: str, top_k: int = DEFAULT_TOP_K) -> SimilarityResponse:
     if not docs or not isinstance(docs, list):
         raise HTTPException(status_code=400, detail="'docs' must be a non-empty list of strings")
     if not query or not isinstance(query, str):
         raise HTTPException(status_code=400, detail="'query' must be a non-empty string")
+    if top_k < 1:
+        raise HTTPException(status_code=400, detail="'top_k' must be at least 1")
 
-    client = get_client()
+    backend = get_backend()
 
     # Generate embeddings for docs in batches
     try:
-        doc_embeddings = []
-        if client is None:
-            # SIM_TEST_MODE: create deterministic small embeddings for testing
-            def simple_embed(text: str):
-                arr = np.array([float(sum(ord(c) for c in text) % 1000), float(len(text) % 100)], dtype=float)
-                return arr
-
-            for d in docs:
-                doc_embeddings.append(simple_embed(d or ""))
-            qemb = simple_embed(query or "")
-        else:
-            for d in docs:
-                if d is None:
-                    d = ""
-                resp = client.embeddings.create(model="text-embedding-3-small", input=d)
-                emb = np.array(resp.data[0].embedding, dtype=float)
-                doc_embeddings.append(emb)
-
-            # query embedding
-            qresp = client.embeddings.create(model="text-embedding-3-small", input=query)
-            qemb = np.array(qresp.data[0].embedding, dtype=float)
+        # the query rides along with the documents in the same batched requests
+        cache = get_cache() if backend.cacheable else None
+        vecs = await cached_embed(backend, [d or "" for d in docs] + [query], cache)
+        doc_embeddings, qemb = vecs[:-1], vecs[-1]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"embedding generation failed: {e}")
 
-    # compute similarities
-    sims = [cosine_similarity(qemb, de) for de in doc_embeddings]
-
-    # get indices of top k
-    top_k = min(top_k, len(docs))
-    idx_sorted = sorted(range(len(sims)), key=lambda i: sims[i], reverse=True)
-    top_idx = idx_sorted[:top_k]
+    # all similarities in one product, then only the top k are sorted
+    top_idx = top_k_cosine(qemb, doc_embeddings, top_k)
 
     matches = [docs[i] for i in top_idx]
 
@@ -114,14 +245,126 @@ def _compute_top_matches(docs: List[str], query: str, top_k: int = 3) -> Similar
 
 @app.post("/similarity", response_model=SimilarityResponse)
 async def similarity(req: SimilarityRequest):
-    return _compute_top_matches(req.docs, req.query, top_k=3)
+    return await _compute_top_matches(req.docs, req.query, top_k=req.top_k)
+
+
+def get_collections() -> CollectionStore:
+    global _collections
+    if _collections is None:
+        _collections = CollectionStore(COLLECTIONS_DIR)
+    return _collections
+
+
+def _get_collection(name: str):
+    try:
+        coll = get_collections().get(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if coll is None:
+        raise HTTPException(status_code=404, detail=f"collection {name!r} not found")
+    return coll
+
+
+async def _embed_for_collection(coll_model: Optional[str], texts: List[str]):
+    backend = get_backend()
+    if coll_model is not None and coll_model != backend.model:
+        raise HTTPException(status_code=409, detail=f"collection was embedded with {coll_model!r}, "
+                                                    f"the service is using {backend.model!r}")
+    try:
+        cache = get_cache() if backend.cacheable else None
+        return backend.model, await cached_embed(backend, texts, cache)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"embedding generation failed: {e}")
+
+
+def _doc_ids(body: CollectionDocs) -> List[str]:
+    if not body.docs:
+        raise HTTPException(status_code=400, detail="'docs' must be a non-empty list of strings")
+    if body.ids is None:
+        return [doc_id(d) for d in body.docs]
+    if len(body.ids) != len(body.docs):
+        raise HTTPException(status_code=400, detail="'ids' must have one entry per document")
+    return body.ids
+
+
+@app.get("/collections")
+async def list_collections():
+    store = get_collections()
+    return [{"name": c.name, "model": c.model, "count": len(c)} for c in map(store.get, store.names())]
+
+
+@app.put("/collections/{name}")
+async def register_collection(name: str, body: CollectionDocs):
+    """Create or replace a collection; its documents are embedded once, here."""
+    ids = _doc_ids(body)
+    store = get_collections()
+    async with _collection_locks.setdefault(name, asyncio.Lock()):
+        model, vecs = await _embed_for_collection(None, body.docs)
+        try:
+            coll = store.create(name, model)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        coll.add(ids, body.docs, vecs)
+        await asyncio.to_thread(store.save, coll)
+    return {"name": name, "count": len(coll)}
+
+
+@app.post("/collections/{name}/docs")
+async def add_documents(name: str, body: CollectionDocs):
+    ids = _doc_ids(body)
+    async with _collection_locks.setdefault(name, asyncio.Lock()):
+        coll = _get_collection(name)
+        _, vecs = await _embed_for_collection(coll.model, body.docs)
+        added = coll.add(ids, body.docs, vecs)
+        await asyncio.to_thread(get_collections().save, coll)
+    return {"name": name, "added": added, "count": len(coll)}
+
+
+@app.delete("/collections/{name}/docs")
+async def remove_documents(name: str, ids: List[str] = Query(...)):
+    async with _collection_locks.setdefault(name, asyncio.Lock()):
+        coll = _get_collection(name)
+        removed = coll.remove(ids)
+        if removed:
+            await asyncio.to_thread(get_collections().save, coll)
+    return {"name": name, "removed": removed, "count": len(coll)}
+
+
+@app.delete("/collections/{name}")
+async def drop_collection(name: str):
+    async with _collection_locks.setdefault(name, asyncio.Lock()):
+        _get_collection(name)
+        get_collections().drop(name)
+    return {"name": name, "dropped": True}
+
+
+@app.post("/collections/{name}/query", response_model=CollectionQueryResponse)
+async def query_collection(name: str, body: CollectionQuery):
+    """Only the query is embedded; documents were embedded when added."""
+    if not body.query:
+        raise HTTPException(status_code=400, detail="'query' must be a non-empty string")
+    if body.top_k < 1:
+        raise HTTPException(status_code=400, detail="'top_k' must be at least 1")
+    coll = _get_collection(name)
+    _, qvec = await _embed_for_collection(coll.model, [body.query])
+    scores = coll.scores(qvec[0])
+    top_idx = top_k_indices(scores, body.top_k)
+    return CollectionQueryResponse(matches=[
+        CollectionMatch(id=coll.ids[i], text=coll.texts[i], score=float(scores[i])) for i in top_idx])
+
+
+@app.get("/similarity/cache")
+async def cache_stats():
+    cache = get_cache()
+    return cache.stats() if cache is not None else {"enabled": False}
 
 
 @app.get("/similarity", response_model=SimilarityResponse)
-async def similarity_get(docs: Optional[List[str]] = None, query: Optional[str] = None):
+async def similarity_get(docs: Optional[List[str]] = None, query: Optional[str] = None,
+                         top_k: int = DEFAULT_TOP_K):
     """Support simple testing via GET: /similarity?docs=one&docs=two&query=hello"""
     # FastAPI already parses repeated query params into list for the docs arg
-    return _compute_top_matches(docs or [], query or "", top_k=3)
+    return await _compute_top_matches(docs or [], query or "", top_k=top_k)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,168 @@
+import json
+import asyncio
+import threading
+
+import httpx
+import numpy as np
+import openai
+from fastapi.testclient import TestClient
+
+import similarity_service
+from similarity_service import app
+from embedding_cache import EmbeddingCache
+from embedding_backends import LocalBackend
+from doc_collections import CollectionStore
+
+
+def stub_client(requests):
+    """AsyncOpenAI client talking to an in-process embeddings stub.
+
+    Each text embeds to [len(text), 1.0], and every request's input list is
+    recorded in ``requests``.
+    """
+    def handler(request: httpx.Request):
+        body = json.loads(request.content)
+        texts = body["input"]
+        requests.append(texts)
+        data = [{"object": "embedding", "index": i, "embedding": [float(len(t)), 1.0]}
+                for i, t in reversed(list(enumerate(texts)))]
+        return httpx.Response(200, json={"object": "list", "data": data, "model": body["model"],
+                                         "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return openai.AsyncOpenAI(api_key="test", base_url="http://stub/v1", http_client=http_client)
+
+
+def test_similarity_batches_and_dedupes(monkeypatch):
+    requests = []
+    monkeypatch.setattr(similarity_service, "get_client", lambda: stub_client(requests))
+    monkeypatch.setattr(similarity_service, "EMBED_BATCH_SIZE", 2)
+    monkeypatch.setattr(similarity_service, "get_cache", lambda: None)
+    docs = ["a" * 10, "b" * 3, "a" * 10, "c" * 20, "d" * 5]
+    r = TestClient(app).post("/similarity", json={"docs": docs, "query": "x" * 4})
+    assert r.status_code == 200
+    # 4 unique docs + the query in batches of 2, duplicates sent once
+    sent = [t for batch in requests for t in batch]
+    assert len(requests) == 3 and max(len(b) for b in requests) <= 2
+    assert sorted(sent) == sorted(set(docs) | {"x" * 4})
+    assert r.json()["matches"] == ["d" * 5, "b" * 3, "a" * 10]
+
+
+def test_similarity_cache_skips_known_texts(monkeypatch, tmp_path):
+    requests = []
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(similarity_service, "get_client", lambda: stub_client(requests))
+    monkeypatch.setattr(similarity_service, "get_cache", lambda: cache)
+    client = TestClient(app)
+    client.post("/similarity", json={"docs": ["one", "three"], "query": "two"})
+    client.post("/similarity", json={"docs": ["one", "three", "four"], "query": "two"})
+    assert requests == [["one", "three", "two"], ["four"]]
+    stats = client.get("/similarity/cache").json()
+    assert stats["misses"] == 4 and stats["memory_hits"] == 3
+
+    # a new process only has the SQLite file
+    cache.close()
+    reopened = EmbeddingCache(str(tmp_path / "cache.sqlite3"))
+    found = reopened.get_many(similarity_service.EMBED_MODEL, ["four", "five"])
+    assert list(found) == ["four"] and found["four"].tolist() == [4.0, 1.0]
+    assert reopened.stats()["disk_hits"] == 1
+
+
+def test_embedding_cache_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_rows=10, memory_entries=2)
+    for i in range(12):
+        cache.put_many("m", [f"t{i}"], [[float(i)]])
+    assert cache.stats()["rows"] <= 10
+    assert "t11" in cache.get_many("m", ["t0", "t11"])
+    assert "t0" not in cache.get_many("m", ["t0"])
+
+
+def test_similarity_top_k(monkeypatch):
+    monkeypatch.setattr(similarity_service, "get_client", lambda: stub_client([]))
+    monkeypatch.setattr(similarity_service, "get_cache", lambda: None)
+    client = TestClient(app)
+    docs = ["a" * n for n in (1, 9, 4, 3, 30)]
+    r = client.post("/similarity", json={"docs": docs, "query": "q" * 4, "top_k": 2})
+    assert r.json()["matches"] == ["a" * 4, "a" * 3]
+    r = client.post("/similarity", json={"docs": docs, "query": "q" * 4, "top_k": 50})
+    assert len(r.json()["matches"]) == 5
+    assert client.post("/similarity", json={"docs": docs, "query": "q", "top_k": 0}).status_code == 400
+
+
+def test_client_is_shared_for_app_lifetime(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    with TestClient(app):
+        client = similarity_service.get_client()
+        assert similarity_service.get_client() is client
+        assert not client._client.is_closed
+    assert client._client.is_closed
+    assert similarity_service._client is None
+
+
+def test_hash_backend_needs_no_network(monkeypatch):
+    monkeypatch.setattr(similarity_service, "EMBED_BACKEND", "hash")
+    monkeypatch.setattr(similarity_service, "_backend", None)
+    docs = ["reset a user password", "book the large meeting room", "quarterly expense report"]
+    r = TestClient(app).post("/similarity", json={"docs": docs, "query": "meeting room booking", "top_k": 1})
+    assert r.json()["matches"] == ["book the large meeting room"]
+
+
+def test_local_backend_encodes_on_worker_thread():
+    threads = []
+
+    class FakeModel:
+        def encode(self, texts, **kwargs):
+            threads.append(threading.current_thread().name)
+            return np.array([[len(t), 1.0] for t in texts])
+
+    backend = LocalBackend()
+    backend._model = FakeModel()
+    vecs = asyncio.run(backend.embed(["ab", "abcd"]))
+    asyncio.run(backend.aclose())
+    assert vecs.dtype == np.float32 and vecs.tolist() == [[2.0, 1.0], [4.0, 1.0]]
+    assert threads[0].startswith("embed")
+
+
+def test_collections_register_query_update(monkeypatch, tmp_path):
+    monkeypatch.setattr(similarity_service, "EMBED_BACKEND", "hash")
+    monkeypatch.setattr(similarity_service, "_backend", None)
+    monkeypatch.setattr(similarity_service, "_collections", CollectionStore(str(tmp_path)))
+    client = TestClient(app)
+    docs = ["reset a user password", "book the large meeting room", "quarterly expense report"]
+    r = client.put("/collections/it", json={"docs": docs, "ids": ["pw", "room", "exp"]})
+    assert r.json() == {"name": "it", "count": 3}
+
+    def query(q, top_k=1):
+        r = client.post("/collections/it/query", json={"query": q, "top_k": top_k})
+        return [m["id"] for m in r.json()["matches"]]
+
+    assert query("meeting room please") == ["room"]
+    assert client.post("/collections/it/docs", json={"docs": ["order a new laptop"], "ids": ["laptop"]}
+                       ).json()["count"] == 4
+    assert query("new laptop") == ["laptop"]
+    client.delete("/collections/it/docs", params={"ids": ["room"]})
+    assert "room" not in query("meeting room please", top_k=10)
+
+    # a fresh store reads the same collection back from disk
+    reopened = CollectionStore(str(tmp_path)).get("it")
+    assert reopened.ids == ["pw", "exp", "laptop"] and reopened.vectors.shape[0] == 3
+    assert client.post("/collections/missing/query", json={"query": "x"}).status_code == 404
+    assert client.put("/collections/../x", json={"docs": ["a"]}).status_code in (400, 404)
+    assert client.delete("/collections/it").json()["dropped"]
+    assert client.get("/collections").json() == []
+
+
+def test_collections_duplicate_ids_in_one_request(monkeypatch, tmp_path):
+    monkeypatch.setattr(similarity_service, "EMBED_BACKEND", "hash")
+    monkeypatch.setattr(similarity_service, "_backend", None)
+    monkeypatch.setattr(similarity_service, "_collections", CollectionStore(str(tmp_path)))
+    client = TestClient(app)
+    assert client.put("/collections/d", json={"docs": ["first", "second"], "ids": ["1", "1"]}
+                      ).json() == {"name": "d", "count": 1}
+    assert client.put("/collections/d", json={"docs": ["same", "same"]}).json()["count"] == 1
+    r = client.post("/collections/d/docs", json={"docs": ["a", "b", "c"], "ids": ["x", "y", "x"]})
+    assert r.json()["added"] == 2 and r.json()["count"] == 3
+
+    coll = CollectionStore(str(tmp_path)).get("d")
+    assert len(coll.ids) == len(coll.texts) == coll.vectors.shape[0] == 3
+    assert coll.texts[coll.ids.index("x")] == "c"